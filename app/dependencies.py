@@ -1,19 +1,68 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.utils.pool_metrics import PoolMetrics, instrumented_pool
 from dotenv import load_dotenv
 import os
+from typing import Optional
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+def _async_database_url(url: str) -> Optional[str]:
+    # Асинхронный движок работает через asyncpg; для других СУБД адрес задаётся в ASYNC_DATABASE_URL
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "postgresql":
+        return None
+    return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+def _pool_options(prefix: str, base, metrics: PoolMetrics) -> dict:
+    # Параметры пула задаются переменными <prefix>_POOL_SIZE и т. д., по умолчанию — общими DB_*
+    def option(name: str, default: str) -> str:
+        return os.getenv(f"{prefix}_{name}", os.getenv(f"DB_{name}", default))
+
+    return {
+        "poolclass": instrumented_pool(base, metrics),
+        "pool_size": int(option("POOL_SIZE", "5")),
+        "max_overflow": int(option("MAX_OVERFLOW", "10")),
+        "pool_timeout": float(option("POOL_TIMEOUT", "30")),
+        "pool_pre_ping": option("POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(option("POOL_RECYCLE", "1800")),
+    }
+
+# Отдельные пулы: запросы API не ждут соединений, занятых приёмом MQTT, и наоборот
+api_pool_metrics = PoolMetrics("api")
+async_pool_metrics = PoolMetrics("api_async")
+ingest_pool_metrics = PoolMetrics("ingest")
+
+engine = create_engine(DATABASE_URL, **_pool_options("API_DB", QueuePool, api_pool_metrics))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+ingest_engine = create_engine(DATABASE_URL, **_pool_options("INGEST_DB", QueuePool, ingest_pool_metrics))
+IngestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ingest_engine)
+
+async_engine = (
+    create_async_engine(ASYNC_DATABASE_URL, **_pool_options("API_DB", AsyncAdaptedQueuePool, async_pool_metrics))
+    if ASYNC_DATABASE_URL else None
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_pool_stats() -> dict:
+    return {metrics.name: metrics.stats() for metrics in (api_pool_metrics, async_pool_metrics, ingest_pool_metrics)}
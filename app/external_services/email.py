@@ -1,4 +1,7 @@
 import smtplib
+import queue
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
@@ -10,6 +13,16 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+# Для локального отладочного SMTP-сервера без TLS и авторизации: SMTP_STARTTLS=false, SMTP_PASSWORD не задан
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USERNAME)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 10))
+# Неиспользуемое соединение закрывается раньше, чем его разорвёт сервер, сек
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", 30))
+
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", 1000))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", 5))
+EMAIL_RETRY_BACKOFF = float(os.getenv("EMAIL_RETRY_BACKOFF", 1.0))
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -77,23 +90,146 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def send_email(to: str, subject: str, message: str, code: str):
-    try:
+class EmailOutbox:
+    def __init__(
+        self,
+        smtp_factory=smtplib.SMTP,
+        queue_size: int = EMAIL_QUEUE_SIZE,
+        max_retries: int = EMAIL_MAX_RETRIES,
+        retry_backoff: float = EMAIL_RETRY_BACKOFF,
+        idle_timeout: float = SMTP_IDLE_TIMEOUT,
+    ):
+        self.smtp_factory = smtp_factory
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connections = 0
+        self._server = None
+        self._last_used = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def enqueue(self, to: str, subject: str, message: str, code: str) -> bool:
+        try:
+            self.queue.put_nowait((to, subject, message, code))
+            return True
+        except queue.Full:
+            print(f"Email queue is full, dropped email to {to}")
+            return False
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                email = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                    self._disconnect()
+                continue
+            try:
+                self.deliver(*email)
+            except Exception as e:
+                print(f"Ошибка при отправке email: {e}")
+        self._disconnect()
+
+    def _connect(self):
+        server = self.smtp_factory(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_PASSWORD:
+            server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        self.connections += 1
+        return server
+
+    def _disconnect(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def deliver(self, to: str, subject: str, message: str, code: str):
         email_body = HTML_TEMPLATE.format(message=message, code=code, year=2025)
 
         msg = MIMEMultipart()
-        msg["From"] = SMTP_USERNAME
+        msg["From"] = SMTP_FROM
         msg["To"] = to
         msg["Subject"] = subject
 
         msg.attach(MIMEText(email_body, "html"))
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(SMTP_USERNAME, to, msg.as_string())
+        attempt = 0
+        while True:
+            reused = self._server is not None
+            try:
+                if not reused:
+                    self._server = self._connect()
+                self._server.sendmail(SMTP_FROM, to, msg.as_string())
+                self._last_used = time.monotonic()
+                self.sent += 1
+                print(f"Email успешно отправлен на {to}")
+                return
+            except smtplib.SMTPRecipientsRefused as e:
+                self.failed += 1
+                print(f"Ошибка при отправке email: {e}")
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._disconnect()
+                # Сервер закрыл простаивавшее соединение: переподключаемся без ожидания
+                if reused:
+                    continue
+                error = "соединение разорвано"
+            except smtplib.SMTPResponseException as e:
+                # Коды 5xx — постоянная ошибка, повтор не поможет
+                if e.smtp_code >= 500:
+                    self._disconnect()
+                    self.failed += 1
+                    print(f"Ошибка при отправке email: {e}")
+                    return
+                self._disconnect()
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()
+                error = e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.failed += 1
+                print(f"Giving up on email to {to} after {self.max_retries} retries: {error}")
+                return
+            self.retries += 1
+            time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "connections": self.connections,
+        }
+
+
+email_outbox = EmailOutbox()
 
-        print(f"Email успешно отправлен на {to}")
 
-    except Exception as e:
-        print(f"Ошибка при отправке email: {e}")
+def send_email(to: str, subject: str, message: str, code: str) -> bool:
+    # Письмо отправляется фоновым потоком, обработчик не ждёт SMTP
+    return email_outbox.enqueue(to, subject, message, code)
@@ -1,26 +1,175 @@
+import os
+import queue
+import threading
+import time
 import firebase_admin
 from firebase_admin import credentials, messaging, exceptions
 from app.models.fcm_token import FCMToken
 from sqlalchemy.orm import Session
-from app.dependencies import SessionLocal
-
-cred = credentials.Certificate("smart-greenhouse-24953-firebase-adminsdk-fbsvc-e37e4bd4bb.json")
-firebase_admin.initialize_app(cred)
-
-def send_push_notification(fcm_token: str, title: str, body: str):
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title=title,
-            body=body,
-        ),
-        token=fcm_token,
-    )
-
-    try:
-        response = messaging.send(message)
-        print("Successfully sent message:", response)
-    except exceptions.FirebaseError as e:
-        print(f"Failed to send message to {fcm_token}: {e}")
-        db: Session = SessionLocal()
-        db.query(FCMToken).filter(FCMToken.token == fcm_token).delete()
-        db.commit()
\ No newline at end of file
+from app.dependencies import IngestSessionLocal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FCM_QUEUE_SIZE = int(os.getenv("FCM_QUEUE_SIZE", 10000))
+FCM_BATCH_SIZE = int(os.getenv("FCM_BATCH_SIZE", 100))
+FCM_MAX_RETRIES = int(os.getenv("FCM_MAX_RETRIES", 3))
+FCM_RETRY_BACKOFF = float(os.getenv("FCM_RETRY_BACKOFF", 1.0))
+FCM_CREDENTIALS = os.getenv("FCM_CREDENTIALS", "smart-greenhouse-24953-firebase-adminsdk-fbsvc-e37e4bd4bb.json")
+# Ограничение FCM на количество токенов в одном multicast-запросе
+FCM_MULTICAST_LIMIT = 500
+
+INVALID_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+    exceptions.InvalidArgumentError,
+)
+RETRYABLE_ERRORS = (
+    messaging.QuotaExceededError,
+    exceptions.UnavailableError,
+    exceptions.InternalError,
+    exceptions.DeadlineExceededError,
+)
+
+_firebase_lock = threading.Lock()
+
+
+def ensure_firebase_app():
+    # Приложение Firebase создаётся при первой отправке через messaging, а не при импорте модуля
+    with _firebase_lock:
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(credentials.Certificate(FCM_CREDENTIALS))
+
+
+class NotificationDispatcher:
+    def __init__(
+        self,
+        backend=messaging,
+        session_factory=IngestSessionLocal,
+        queue_size: int = FCM_QUEUE_SIZE,
+        batch_size: int = FCM_BATCH_SIZE,
+        max_retries: int = FCM_MAX_RETRIES,
+        retry_backoff: float = FCM_RETRY_BACKOFF,
+    ):
+        self.backend = backend
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="fcm-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def notify(self, id_user: int, title: str, body: str) -> bool:
+        try:
+            self.queue.put_nowait((id_user, title, body))
+            return True
+        except queue.Full:
+            print(f"Notification queue is full, dropped notification for user {id_user}")
+            return False
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                print(f"Error dispatching notifications: {e}")
+
+    def process_batch(self, batch: list):
+        db: Session = self.session_factory()
+        try:
+            user_ids = {id_user for id_user, _, _ in batch}
+            tokens_by_user = {}
+            for id_user, token in db.query(FCMToken.id_user, FCMToken.token).filter(FCMToken.id_user.in_(user_ids)):
+                tokens_by_user.setdefault(id_user, []).append(token)
+
+            if self.backend is messaging and tokens_by_user:
+                ensure_firebase_app()
+
+            invalid_tokens = set()
+            for id_user, title, body in batch:
+                tokens = tokens_by_user.get(id_user, [])
+                # Ошибка одной тревоги не прерывает отправку остальных уведомлений пачки
+                try:
+                    for start in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+                        invalid_tokens |= self._send(tokens[start:start + FCM_MULTICAST_LIMIT], title, body)
+                except Exception as e:
+                    print(f"Failed to send notification to user {id_user}: {e}")
+
+            # Недействительные токены удаляются одним запросом на пачку
+            if invalid_tokens:
+                db.query(FCMToken).filter(FCMToken.token.in_(invalid_tokens)).delete(synchronize_session=False)
+                db.commit()
+                print(f"Removed {len(invalid_tokens)} invalid FCM tokens")
+        finally:
+            db.close()
+
+    def _send(self, tokens: list, title: str, body: str) -> set:
+        invalid_tokens = set()
+        pending = tokens
+        attempt = 0
+
+        while pending:
+            message = messaging.MulticastMessage(
+                notification=messaging.Notification(
+                    title=title,
+                    body=body,
+                ),
+                tokens=pending,
+            )
+
+            retry = []
+            try:
+                response = self.backend.send_each_for_multicast(message)
+                for token, result in zip(pending, response.responses):
+                    if result.success:
+                        continue
+                    if isinstance(result.exception, INVALID_TOKEN_ERRORS):
+                        invalid_tokens.add(token)
+                    elif isinstance(result.exception, RETRYABLE_ERRORS):
+                        retry.append(token)
+                    else:
+                        print(f"Failed to send message to {token}: {result.exception}")
+                print(f"Successfully sent {response.success_count} of {len(pending)} messages")
+            except RETRYABLE_ERRORS as e:
+                print(f"Failed to send multicast message: {e}")
+                retry = pending
+            except exceptions.FirebaseError as e:
+                print(f"Failed to send multicast message, not retrying: {e}")
+                break
+
+            pending = retry
+            attempt += 1
+            if pending and attempt > self.max_retries:
+                print(f"Giving up on {len(pending)} messages after {self.max_retries} retries")
+                break
+            if pending:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+        return invalid_tokens
+
+
+notification_dispatcher = NotificationDispatcher()
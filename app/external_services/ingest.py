@@ -0,0 +1,247 @@
+import os
+import queue
+import threading
+import time
+import zlib
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from app.dependencies import Base, IngestSessionLocal
+from app.external_services.journal import IngestJournal, ingest_journal
+from app.utils.latest_values import upsert_latest
+from app.utils.rollups import upsert_rollups
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 1.0))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_PUT_TIMEOUT = float(os.getenv("INGEST_PUT_TIMEOUT", 1.0))
+INGEST_JOURNAL_REPLAY_BATCH = int(os.getenv("INGEST_JOURNAL_REPLAY_BATCH", 100))
+INGEST_JOURNAL_RETRY_INTERVAL = float(os.getenv("INGEST_JOURNAL_RETRY_INTERVAL", 5.0))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+INGEST_SHARD_QUEUE_SIZE = int(os.getenv("INGEST_SHARD_QUEUE_SIZE", 1000))
+# Окно, за которое считается скорость обработки потока, сек
+INGEST_THROUGHPUT_WINDOW = float(os.getenv("INGEST_THROUGHPUT_WINDOW", 10.0))
+
+# Ошибки, при которых базу отвергают сами строки: повтор их не исправит
+REJECTED_ROW_ERRORS = (IntegrityError, DataError)
+
+
+class IngestWriter:
+    def __init__(
+        self,
+        flush_size: int = INGEST_FLUSH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        journal: IngestJournal = ingest_journal,
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.journal = journal
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_replay = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def put(self, model, rows: list) -> bool:
+        if not rows:
+            return True
+        try:
+            self.queue.put((model.__tablename__, rows), timeout=INGEST_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            # Очередь переполнена: строки сохраняются в журнал и будут записаны позже
+            self.journal.append(model.__tablename__, rows)
+            print(f"Ingest queue is full, spilled {len(rows)} rows for '{model.__tablename__}' to journal")
+            return False
+
+    def _run(self):
+        buffers = {}
+        buffered = 0
+        deadline = None
+
+        while not (self._stop.is_set() and self.queue.empty()):
+            timeout = self.flush_interval if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                table, rows = self.queue.get(timeout=timeout)
+                buffers.setdefault(table, []).extend(rows)
+                buffered += len(rows)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            # Сбрасываем буфер по размеру пачки или по истечении интервала
+            if buffered and (buffered >= self.flush_size or time.monotonic() >= deadline):
+                self._flush(buffers)
+                buffers = {}
+                buffered = 0
+                deadline = None
+            elif time.monotonic() >= self._next_replay:
+                self._replay()
+
+        if buffered:
+            self._flush(buffers)
+
+    def _write(self, batch: list):
+        db = IngestSessionLocal()
+        try:
+            for table, rows in batch:
+                db.execute(insert(Base.metadata.tables[table]), rows)
+                upsert_latest(db, table, rows)
+                upsert_rollups(db, table, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _replay(self) -> bool:
+        if not self.journal.has_pending():
+            return True
+        try:
+            replayed = self.journal.replay(self._write, INGEST_JOURNAL_REPLAY_BATCH, rejected=REJECTED_ROW_ERRORS)
+            print(f"Replayed {replayed} rows from ingest journal")
+            return True
+        except Exception as e:
+            self._next_replay = time.monotonic() + INGEST_JOURNAL_RETRY_INTERVAL
+            print(f"Ingest journal replay failed: {e}")
+            return False
+
+    def _flush(self, buffers: dict):
+        batch = list(buffers.items())
+        # Пока журнал не пуст, новые строки встают за ним, чтобы сохранить порядок записи
+        if time.monotonic() >= self._next_replay and self._replay():
+            try:
+                self._write(batch)
+                return
+            except REJECTED_ROW_ERRORS as e:
+                # Пачка уходит в журнал, где отвергнутые строки отделяются от остальных при воспроизведении
+                print(f"Ingest batch rejected by database: {e}")
+            except Exception as e:
+                self._next_replay = time.monotonic() + INGEST_JOURNAL_RETRY_INTERVAL
+                print(f"Error flushing ingest batch: {e}")
+
+        for table, rows in batch:
+            self.journal.append(table, rows)
+        print(f"Spilled {sum(len(rows) for _, rows in batch)} rows to ingest journal")
+
+    def stats(self) -> dict:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "queue_depth": self.queue.qsize(),
+            "journal": self.journal.stats(),
+        }
+
+
+class IngestShard:
+    def __init__(self, index: int, handler, queue_size: int):
+        self.index = index
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.dropped = 0
+        self.stalled = False
+        self.throughput = 0.0
+        self._window = (time.monotonic(), 0)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-shard-{index}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if wait:
+            self._thread.join()
+
+    def _update_throughput(self):
+        # Скорость считает сам поток по фиксированным окнам, поэтому чтение stats() ничего не сбрасывает
+        now = time.monotonic()
+        since, processed_before = self._window
+        if now - since >= INGEST_THROUGHPUT_WINDOW:
+            self.throughput = (self.processed - processed_before) / (now - since)
+            self._window = (now, self.processed)
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                self._update_throughput()
+                continue
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"Error in ingest shard {self.index}: {e}")
+            self.processed += 1
+            self._update_throughput()
+
+    def stats(self) -> dict:
+        return {
+            "shard": self.index,
+            "queue_depth": self.queue.qsize(),
+            "processed": self.processed,
+            "throughput": round(self.throughput, 2),
+            "dropped": self.dropped,
+        }
+
+
+class ShardedWorkerPool:
+    def __init__(self, handler, workers: int = INGEST_WORKERS, queue_size: int = INGEST_SHARD_QUEUE_SIZE):
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.queue_size = queue_size
+        self.shards = []
+
+    def start(self):
+        if self.shards:
+            return
+        self.shards = [IngestShard(index, self.handler, self.queue_size) for index in range(self.workers)]
+        for shard in self.shards:
+            shard.start()
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop(wait=False)
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
+
+    def shard_for(self, key: str) -> int:
+        # Стабильный хэш: сообщения одной теплицы всегда попадают в один поток
+        return zlib.crc32(key.encode()) % self.workers
+
+    def submit(self, key: str, item) -> bool:
+        shard = self.shards[self.shard_for(key)]
+        # Поток paho нельзя держать долго: без keepalive брокер разорвёт соединение. Место в полной очереди
+        # ждём не дольше INGEST_PUT_TIMEOUT, а пока поток обработки не принял сообщение, не ждём вовсе
+        try:
+            shard.queue.put(item, timeout=0 if shard.stalled else INGEST_PUT_TIMEOUT)
+            shard.stalled = False
+            return True
+        except queue.Full:
+            shard.stalled = True
+            shard.dropped += 1
+            print(f"Ingest shard {shard.index} is full, dropped message for {key}")
+            return False
+
+    def stats(self) -> list:
+        return [shard.stats() for shard in self.shards]
+
+
+ingest_writer = IngestWriter()
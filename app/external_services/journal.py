@@ -0,0 +1,208 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_JOURNAL_DIR = os.getenv("INGEST_JOURNAL_DIR", "ingest_journal")
+INGEST_JOURNAL_SEGMENT_SIZE = int(os.getenv("INGEST_JOURNAL_SEGMENT_SIZE", 16 * 1024 * 1024))
+# Подкаталог журнала для записей, которые база отвергает из-за самих данных
+DEAD_LETTER_DIR = "dead_letter"
+
+SEGMENT_MAGIC = b"GHJ1"
+# Заголовок сегмента: сигнатура, резерв и смещение первой непрочитанной записи
+HEADER = struct.Struct("<4s4xQ")
+RECORD_LENGTH = struct.Struct("<I")
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JournalSegment:
+    def __init__(self, path: str, size: int = None):
+        self.path = path
+        is_new = not os.path.exists(path)
+        self._file = open(path, "w+b" if is_new else "r+b")
+        if is_new:
+            self._file.truncate(size)
+        self.size = os.path.getsize(path)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+        if is_new:
+            self._map[:HEADER.size] = HEADER.pack(SEGMENT_MAGIC, HEADER.size)
+            self.read_offset = HEADER.size
+        else:
+            magic, self.read_offset = HEADER.unpack_from(self._map)
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"Journal segment {path} is corrupted")
+
+        # Конец записанных данных находится проходом по записям после восстановления
+        self.write_offset = self.read_offset
+        self.records = 0
+        while self.write_offset + RECORD_LENGTH.size <= self.size:
+            (length,) = RECORD_LENGTH.unpack_from(self._map, self.write_offset)
+            if length == 0 or self.write_offset + RECORD_LENGTH.size + length > self.size:
+                break
+            self.write_offset += RECORD_LENGTH.size + length
+            self.records += 1
+
+    def append(self, payload: bytes) -> bool:
+        end = self.write_offset + RECORD_LENGTH.size + len(payload)
+        if end > self.size:
+            return False
+        self._map[self.write_offset + RECORD_LENGTH.size:end] = payload
+        # Длина пишется последней, чтобы оборванная запись не считалась записанной
+        RECORD_LENGTH.pack_into(self._map, self.write_offset, len(payload))
+        self._map.flush()
+        self.write_offset = end
+        self.records += 1
+        return True
+
+    def read(self, limit: int) -> list:
+        records = []
+        offset = self.read_offset
+        while offset < self.write_offset and len(records) < limit:
+            (length,) = RECORD_LENGTH.unpack_from(self._map, offset)
+            start = offset + RECORD_LENGTH.size
+            offset = start + length
+            records.append((offset, bytes(self._map[start:offset])))
+        return records
+
+    def commit(self, offset: int, records: int):
+        HEADER.pack_into(self._map, 0, SEGMENT_MAGIC, offset)
+        self._map.flush()
+        self.read_offset = offset
+        self.records -= records
+
+    @property
+    def pending_bytes(self) -> int:
+        return self.write_offset - self.read_offset
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class IngestJournal:
+    def __init__(self, directory: str = INGEST_JOURNAL_DIR, segment_size: int = INGEST_JOURNAL_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._segments = None
+        self._sequence = 0
+        self._dead_letter = None
+        self.replayed_rows = 0
+        self.replay_rate = 0.0
+        self.dead_letter_records = 0
+
+    def _open(self):
+        if self._segments is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+        self._segments = [JournalSegment(os.path.join(self.directory, name)) for name in names]
+        if names:
+            self._sequence = int(names[-1].split(".")[0])
+
+    def append(self, table: str, rows: list):
+        self._append(json.dumps({"table": table, "rows": rows}, default=_encode).encode())
+
+    def _append(self, payload: bytes):
+        with self._lock:
+            self._open()
+            if not self._segments or not self._segments[-1].append(payload):
+                self._sequence += 1
+                size = max(self.segment_size, HEADER.size + RECORD_LENGTH.size + len(payload))
+                segment = JournalSegment(os.path.join(self.directory, f"{self._sequence:08d}.seg"), size)
+                segment.append(payload)
+                self._segments.append(segment)
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            self._open()
+            return any(segment.records for segment in self._segments)
+
+    def _move_to_dead_letter(self, payload: bytes):
+        if self._dead_letter is None:
+            self._dead_letter = IngestJournal(os.path.join(self.directory, DEAD_LETTER_DIR), self.segment_size)
+        self._dead_letter._append(payload)
+        self.dead_letter_records += 1
+
+    def replay(self, handler, limit: int = 100, rejected: tuple = ()) -> int:
+        # Записи отдаются обработчику пачками строго в порядке записи;
+        # смещение чтения сдвигается только после успешной обработки пачки.
+        # Если пачку отвергли исключением из rejected, записи повторяются по одной,
+        # а снова отвергнутые уходят в dead_letter и больше не задерживают журнал
+        replayed = 0
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                self._open()
+                while self._segments and not self._segments[0].records:
+                    segment = self._segments.pop(0)
+                    segment.close()
+                    os.remove(segment.path)
+                if not self._segments or not self._segments[0].records:
+                    break
+                segment = self._segments[0]
+                records = segment.read(limit)
+
+            batch = []
+            for _, payload in records:
+                record = json.loads(payload)
+                for row in record["rows"]:
+                    if "timestamp" in row:
+                        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                batch.append((record["table"], record["rows"]))
+            try:
+                handler(batch)
+            except rejected:
+                replayed += self._replay_one_by_one(segment, records, batch, handler, rejected)
+                continue
+
+            with self._lock:
+                segment.commit(records[-1][0], len(records))
+            replayed += sum(len(rows) for _, rows in batch)
+
+        if replayed:
+            elapsed = time.monotonic() - started
+            self.replayed_rows += replayed
+            self.replay_rate = round(replayed / elapsed, 2) if elapsed > 0 else 0.0
+        return replayed
+
+    def _replay_one_by_one(self, segment: JournalSegment, records: list, batch: list, handler, rejected: tuple) -> int:
+        replayed = 0
+        for (offset, payload), record in zip(records, batch):
+            try:
+                handler([record])
+                replayed += len(record[1])
+            except rejected as e:
+                print(f"Ingest journal record for '{record[0]}' rejected, moved to dead letter: {e}")
+                self._move_to_dead_letter(payload)
+            # Смещение сдвигается после каждой записи, чтобы при сбое базы не записать их повторно
+            with self._lock:
+                segment.commit(offset, 1)
+        return replayed
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._open()
+            return {
+                "segments": len(self._segments),
+                "pending_records": sum(segment.records for segment in self._segments),
+                "pending_bytes": sum(segment.pending_bytes for segment in self._segments),
+                "replayed_rows": self.replayed_rows,
+                "replay_rate": self.replay_rate,
+                "dead_letter_records": self.dead_letter_records,
+            }
+
+
+ingest_journal = IngestJournal()
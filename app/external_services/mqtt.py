@@ -1,24 +1,74 @@
 import json
+import math
+import os
 from datetime import datetime
-from paho.mqtt.client import Client
+from paho.mqtt.client import Client, MQTTv311, MQTTv5
 from sqlalchemy.orm import Session
-from app.dependencies import SessionLocal
+from app.dependencies import IngestSessionLocal, ingest_engine, ingest_pool_metrics
 from app.models.sensor_reading import SensorReading
 from app.models.device_state import DeviceState
 from app.models.setting import Setting
 from app.models.greenhouse import Greenhouse
-from app.models.sensor_alert_state import SensorAlertState
-from app.external_services.fcm import send_push_notification
-
-MQTT_BROKER = "broker.emqx.io"
+from app.external_services.fcm import notification_dispatcher
+from app.external_services.ingest import ingest_writer, ShardedWorkerPool
+from app.utils.greenhouse_cache import resolve_greenhouse, invalidate_greenhouse, greenhouse_listener
+from app.utils.alert_state_cache import alert_state_cache
+from app.utils.threshold_engine import threshold_engine
+from app.utils.latest_values import backfill_latest_values
+from app.utils.reference_data import reference_data
+from app.utils.rollups import backfill_rollups
+from app.jobs.partitions import ensure_partitions, partition_maintenance
+from app.jobs.retention import retention_job, ensure_compaction_indexes
+
+MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.emqx.io")
+# Группа общей подписки MQTT v5: узлы приёма с одной группой делят поток сообщений
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP")
 TOPIC_SENSOR_PATTERN = "m/+/d/cur"
 TOPIC_DEVICE_PATTERN = "m/+/st/cur"
 TOPIC_SETTING_PATTERN = "m/+/s/cur"
 TOPIC_REGISTER_PATTERN = "m/+/reg"
 
-client = Client()
+client = Client(protocol=MQTTv5 if MQTT_SHARED_GROUP else MQTTv311)
+
+def subscription_topic(pattern: str) -> str:
+    if MQTT_SHARED_GROUP:
+        return f"$share/{MQTT_SHARED_GROUP}/{pattern}"
+    return pattern
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    # Подписка оформляется при каждом подключении, чтобы пережить переподключения к брокеру
+    client.subscribe([
+        (subscription_topic(TOPIC_SENSOR_PATTERN), 0),
+        (subscription_topic(TOPIC_DEVICE_PATTERN), 0),
+        (subscription_topic(TOPIC_SETTING_PATTERN), 0),
+        (subscription_topic(TOPIC_REGISTER_PATTERN), 0)
+    ])
 
 def on_message(client, userdata, msg):
+    topic_parts = msg.topic.split('/')
+    if len(topic_parts) < 2:
+        print(f"Unexpected topic {msg.topic}")
+        return
+    message_pool.submit(topic_parts[1], msg)
+
+def valid_values(data: dict, known_ids, topic: str) -> dict:
+    # Строка с неизвестным id или нечисловым значением отвергается базой и задержала бы всю пачку,
+    # поэтому такие значения отбрасываются до постановки в очередь записи
+    values = {}
+    for key, value in data.items():
+        try:
+            id_ = int(key)
+        except (TypeError, ValueError):
+            id_ = None
+        if id_ not in known_ids or not isinstance(value, (int, float)) or not math.isfinite(value):
+            print(f"Skipping invalid value {key}={value!r} on topic {topic}")
+            continue
+        values[id_] = value
+    return values
+
+def handle_message(msg):
+    db = None
+    greenhouse = None
     try:
         topic_parts = msg.topic.split('/')
         guid = str(topic_parts[1])
@@ -26,10 +76,9 @@ def on_message(client, userdata, msg):
         payload = msg.payload.decode()
         data = json.loads(payload)
         print(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
+        received_at = datetime.utcnow()
 
-        db: Session = SessionLocal()
-
-        greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
+        db: Session = IngestSessionLocal()
 
         # Обработка сообщения для топика регистрации
         if msg.topic.endswith("/reg"):
@@ -38,6 +87,7 @@ def on_message(client, userdata, msg):
                 print("Missing 'pin' in registration payload")
                 return
 
+            greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
             if not greenhouse:
                 new_greenhouse = Greenhouse(guid=guid, pin=pin)
                 db.add(new_greenhouse)
@@ -49,80 +99,46 @@ def on_message(client, userdata, msg):
                 print(f"Updated PIN for GUID {guid} to {pin}")
             else:
                 print(f"Greenhouse with GUID {guid} already assigned to a user")
+            invalidate_greenhouse(guid)
             return
 
+        # При недоступной базе используется последняя известная запись, чтобы строки попали в журнал
+        greenhouse = resolve_greenhouse(db, guid, allow_stale=True)
+
         # Обработка сообщения для топика sensor_reading
         if msg.topic.endswith("d/cur"):
             if not greenhouse:
                 print(f"Greenhouse with GUID {guid} not found")
                 return
 
+            data = valid_values(data, reference_data.sensors.by_id, msg.topic)
+            readings = [
+                {
+                    "id_sensor": id_sensor,
+                    "id_greenhouse": greenhouse.id_greenhouse,
+                    "value": value,
+                    "timestamp": received_at,
+                }
+                for id_sensor, value in data.items()
+            ]
+            # Показания ставятся в очередь до проверки порогов: той может понадобиться база,
+            # а при её недоступности строки должны попасть в журнал
+            ingest_writer.put(SensorReading, readings)
+
             notifications = []
-            for key, value in data.items():
-                id_sensor = int(key)
-                new_reading = SensorReading(
-                    id_sensor=id_sensor,
-                    id_greenhouse=greenhouse.id_greenhouse,
-                    value=value,
-                )
-                db.add(new_reading)
-
-                # Получаем состояние уведомления для этого датчика
-                alert_state = db.query(SensorAlertState).filter(
-                    SensorAlertState.id_sensor == id_sensor,
-                    SensorAlertState.id_greenhouse == greenhouse.id_greenhouse
-                ).first()
-
-                if not alert_state:
-                    # Если состояние ещё не создано, создаём его
-                    alert_state = SensorAlertState(
-                        id_sensor=id_sensor,
-                        id_greenhouse=greenhouse.id_greenhouse,
-                        last_alert_sent=False
-                    )
-                    db.add(alert_state)
-
-                # Логика проверки превышения порогов
-                if id_sensor == 1 and value > 60:  # Температура воздуха
-                    if not alert_state.last_alert_sent:
-                        notifications.append(f"Температура воздуха превышает 60°C ({value}°C)")
-                        alert_state.last_alert_sent = True
-                        alert_state.alert_timestamp = datetime.utcnow()
-                elif id_sensor == 2 and value > 80:  # Влажность воздуха
-                    if not alert_state.last_alert_sent:
-                        notifications.append(f"Влажность воздуха превышает 80% ({value}%)")
-                        alert_state.last_alert_sent = True
-                        alert_state.alert_timestamp = datetime.utcnow()
-                elif id_sensor == 3 and value > 85:  # Влажность почвы 1
-                    if not alert_state.last_alert_sent:
-                        notifications.append(f"Влажность почвы 1 превышает 85% ({value}%)")
-                        alert_state.last_alert_sent = True
-                        alert_state.alert_timestamp = datetime.utcnow()
-                elif id_sensor == 4 and value > 85:  # Влажность почвы 2
-                    if not alert_state.last_alert_sent:
-                        notifications.append(f"Влажность почвы 2 превышает 85% ({value}%)")
-                        alert_state.last_alert_sent = True
-                        alert_state.alert_timestamp = datetime.utcnow()
-                else:
-                    # Если значение вернулось в норму, сбрасываем флаг уведомления
-                    alert_state.last_alert_sent = False
-
-                db.add(alert_state)
-
-            user = greenhouse.owner
-
-            if notifications and user and user.fcm_tokens:
-                for token in user.fcm_tokens:
-                    title = f"Уведомление от теплицы {greenhouse.title or greenhouse.guid}"
-                    body = "\n".join(notifications)
-                    send_push_notification(token, title, body)
-                print(f"Уведомления отправлены для теплицы {guid}: {notifications}")
-
-            # if notifications and user and user.fcm_token:
-            #     title = f"Уведомление от теплицы {greenhouse.title or greenhouse.guid}"
-            #     body = "\n".join(notifications)
-            #     send_push_notification(user.fcm_token, title, body)
-            #     print(f"Уведомления отправлены для теплицы {guid}: {notifications}")
+            alerts = threshold_engine.evaluate(db, greenhouse.id_greenhouse, data)
+            for id_sensor in data:
+                alert_message = alerts.get(id_sensor)
+
+                # В базу пишется только смена состояния уведомления
+                if alert_state_cache.update(db, greenhouse.id_greenhouse, id_sensor, alert_message is not None):
+                    notifications.append(alert_message)
+
+            if notifications and greenhouse.id_user is not None:
+                title = f"Уведомление от теплицы {greenhouse.title or greenhouse.guid}"
+                body = "\n".join(notifications)
+                notification_dispatcher.notify(greenhouse.id_user, title, body)
+                print(f"Уведомления поставлены в очередь для теплицы {guid}: {notifications}")
 
             print(f"Sensor readings saved for GUID {guid}")
 
@@ -132,14 +148,16 @@ def on_message(client, userdata, msg):
                 print(f"Greenhouse with GUID {guid} not found")
                 return
 
-            for key, value in data.items():
-                id_device = int(key)
-                new_state = DeviceState(
-                    id_device=id_device,
-                    id_greenhouse=greenhouse.id_greenhouse,
-                    state=bool(value),
-                )
-                db.add(new_state)
+            states = [
+                {
+                    "id_device": id_device,
+                    "id_greenhouse": greenhouse.id_greenhouse,
+                    "state": bool(value),
+                    "timestamp": received_at,
+                }
+                for id_device, value in valid_values(data, reference_data.devices.by_id, msg.topic).items()
+            ]
+            ingest_writer.put(DeviceState, states)
             print(f"Device states saved for GUID {guid}")
 
         # Обработка сообщения для топика setting
@@ -148,30 +166,75 @@ def on_message(client, userdata, msg):
                 print(f"Greenhouse with GUID {guid} not found")
                 return
 
-            for key, value in data.items():
-                id_parameter= int(key)
-                new_setting = Setting(
-                    id_parameter=id_parameter,
-                    id_greenhouse=greenhouse.id_greenhouse,
-                    value=value,
-                )
-                db.add(new_setting)
+            settings = [
+                {
+                    "id_parameter": id_parameter,
+                    "id_greenhouse": greenhouse.id_greenhouse,
+                    "value": value,
+                    "timestamp": received_at,
+                }
+                for id_parameter, value in valid_values(data, reference_data.parameters.by_id, msg.topic).items()
+            ]
+            ingest_writer.put(Setting, settings)
+            threshold_engine.update_settings(
+                db,
+                greenhouse.id_greenhouse,
+                {setting["id_parameter"]: setting["value"] for setting in settings},
+            )
             print(f"Settings saved for GUID {guid}")
 
         db.commit()
     except Exception as e:
         print(f"Error processing message: {e}")
+        if greenhouse is not None:
+            alert_state_cache.invalidate(greenhouse.id_greenhouse)
+    finally:
+        if db is not None:
+            db.close()
+
+message_pool = ShardedWorkerPool(handle_message)
 
 def start_mqtt_listener():
+    with ingest_engine.begin() as connection:
+        ensure_partitions(connection)
+        ensure_compaction_indexes(connection)
+    with IngestSessionLocal() as db:
+        backfill_latest_values(db)
+        backfill_rollups(db)
+    greenhouse_listener.start()
+    ingest_writer.start()
+    notification_dispatcher.start()
+    message_pool.start()
+    partition_maintenance.start()
+    retention_job.start()
+    client.on_connect = on_connect
     client.on_message = on_message
     client.connect(MQTT_BROKER)
-    client.subscribe([
-        (TOPIC_SENSOR_PATTERN, 0),
-        (TOPIC_DEVICE_PATTERN, 0),
-        (TOPIC_SETTING_PATTERN, 0),
-        (TOPIC_REGISTER_PATTERN, 0)
-    ])
     client.loop_start()
 
+def start_mqtt_publisher():
+    # Режим API: клиент только публикует команды и ни на что не подписывается
+    client.connect(MQTT_BROKER)
+    client.loop_start()
+
+def stop_mqtt_listener():
+    client.loop_stop()
+    client.disconnect()
+    retention_job.stop()
+    partition_maintenance.stop()
+    message_pool.stop()
+    ingest_writer.stop()
+    notification_dispatcher.stop()
+    greenhouse_listener.stop()
+
+def get_ingest_stats() -> dict:
+    return {
+        "writer": ingest_writer.stats(),
+        "shards": message_pool.stats(),
+        "retention": retention_job.stats(),
+        "partitions": partition_maintenance.stats(),
+        "db_pool": ingest_pool_metrics.stats(),
+    }
+
 def publish_to_mqtt(topic: str, message: str):
     client.publish(topic, message)
@@ -0,0 +1,48 @@
+# Отдельный процесс приёма MQTT: python -m app.ingest
+import os
+import signal
+import threading
+from app.dependencies import Base, ingest_engine
+from app.external_services.mqtt import start_mqtt_listener, stop_mqtt_listener, get_ingest_stats
+from app.models.greenhouse import Greenhouse
+from app.models.sensor_reading import SensorReading
+from app.models.device_state import DeviceState
+from app.models.sensor import Sensor
+from app.models.device import Device
+from app.models.user import User
+from app.models.fcm_token import FCMToken
+from app.models.parameter import Parameter
+from app.models.setting import Setting
+from app.models.sensor_alert_state import SensorAlertState
+from app.models.sensor_latest import SensorLatest
+from app.models.device_state_latest import DeviceStateLatest
+from app.models.setting_latest import SettingLatest
+from app.models.sensor_reading_rollup import SensorReadingHourly, SensorReadingDaily
+from app.models.retention_watermark import RetentionWatermark
+from app.utils.reference_data import reference_data
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_STATS_INTERVAL = float(os.getenv("INGEST_STATS_INTERVAL", 60))
+
+def main():
+    Base.metadata.create_all(bind=ingest_engine)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Перечитать справочники датчиков, устройств и параметров: kill -HUP <pid>
+    signal.signal(signal.SIGHUP, lambda signum, frame: reference_data.reload())
+
+    start_mqtt_listener()
+    print("MQTT ingest started")
+
+    while not stop.wait(INGEST_STATS_INTERVAL):
+        print(f"Ingest stats: {get_ingest_stats()}")
+
+    stop_mqtt_listener()
+    print("MQTT ingest stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Выгрузка закрытых месяцев истории в Parquet: python -m app.jobs.archive
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, text
+from app.dependencies import Base, IngestSessionLocal, ingest_engine
+from app.jobs.partitions import month_start
+from app.models.greenhouse import Greenhouse
+from app.models.sensor_reading import SensorReading
+from app.models.device_state import DeviceState
+from app.models.sensor import Sensor
+from app.models.device import Device
+from app.models.user import User
+from app.models.fcm_token import FCMToken
+from app.utils.archive import ARCHIVE_DIR, ARCHIVE_TABLES, archive_path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 50000))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+
+
+def _marker_path(table: str, month: datetime) -> str:
+    return os.path.join(ARCHIVE_DIR, table, f"{month:%Y-%m}.done")
+
+
+def last_archived_month(table: str) -> Optional[datetime]:
+    directory = os.path.join(ARCHIVE_DIR, table)
+    if not os.path.isdir(directory):
+        return None
+    months = [datetime.strptime(name[:-len(".done")], "%Y-%m") for name in os.listdir(directory) if name.endswith(".done")]
+    return max(months, default=None)
+
+
+def archive_month(table: str, id_greenhouse: int, month: datetime) -> int:
+    key_column, value_column, schema = ARCHIVE_TABLES[table]
+    columns = Base.metadata.tables[table].c
+    path = archive_path(table, id_greenhouse, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    statement = (
+        select(columns.timestamp, columns[key_column], columns[value_column])
+        .where(
+            columns.id_greenhouse == id_greenhouse,
+            columns.timestamp >= month,
+            columns.timestamp < month_start(month, 1),
+        )
+        .order_by(columns.timestamp, columns[key_column])
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+
+    # Файл пишется под временным именем и появляется только после полной выгрузки месяца
+    rows = 0
+    db = IngestSessionLocal()
+    try:
+        with pq.ParquetWriter(f"{path}.tmp", schema, compression=ARCHIVE_COMPRESSION) as writer:
+            for partition in db.execute(statement).partitions():
+                writer.write_table(pa.Table.from_pylist(
+                    [dict(zip(schema.names, row)) for row in partition],
+                    schema=schema,
+                ))
+                rows += len(partition)
+    finally:
+        db.close()
+    os.replace(f"{path}.tmp", path)
+    return rows
+
+
+def archive_closed_months(now: datetime = None) -> dict:
+    current = month_start(now or datetime.utcnow())
+    archived = {}
+    for table in ARCHIVE_TABLES:
+        # Уже выгруженные месяцы повторно не сканируются
+        since = last_archived_month(table)
+        since = month_start(since, 1) if since else datetime.min
+        with ingest_engine.begin() as connection:
+            candidates = connection.execute(
+                text(
+                    f"SELECT DISTINCT date_trunc('month', \"timestamp\") AS month, id_greenhouse FROM \"{table}\" "
+                    f"WHERE \"timestamp\" >= :since AND \"timestamp\" < :current ORDER BY month, id_greenhouse"
+                ),
+                {"since": since, "current": current},
+            ).all()
+
+        archived[table] = 0
+        months = sorted({month for month, _ in candidates})
+        for month in months:
+            for _, id_greenhouse in (row for row in candidates if row.month == month):
+                archived[table] += archive_month(table, id_greenhouse, month)
+            open(_marker_path(table, month), "w").close()
+            print(f"Archived {table} for {month:%Y-%m}")
+    return archived
+
+
+def _merge_into_archive(table: str, id_greenhouse: int, month: datetime, rows: list):
+    key_column, value_column, schema = ARCHIVE_TABLES[table]
+    path = archive_path(table, id_greenhouse, month)
+    archived = schema.empty_table()
+    if os.path.exists(path):
+        with pa.memory_map(path) as source:
+            archived = pq.read_table(source)
+    late = pa.Table.from_pylist([dict(zip(schema.names, row)) for row in rows], schema=schema)
+    merged = pa.concat_tables([archived, late]).sort_by([("timestamp", "ascending"), (key_column, "ascending")])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(merged, f"{path}.tmp", compression=ARCHIVE_COMPRESSION)
+    os.replace(f"{path}.tmp", path)
+
+
+def ensure_archived(table: str, rows) -> int:
+    """Дописывает в архив строки (timestamp, id_greenhouse, ключ, значение), которых в нём нет.
+
+    Месяц выгружается один раз после закрытия, но строки из журнала приёма могут прийти позже,
+    поэтому очистка передаёт сюда каждую пачку перед её удалением.
+    """
+    schema = ARCHIVE_TABLES[table][2]
+    groups = {}
+    for timestamp, id_greenhouse, key, value in rows:
+        groups.setdefault((id_greenhouse, month_start(timestamp)), []).append((timestamp, key, value))
+
+    added = 0
+    for (id_greenhouse, month), group in groups.items():
+        path = archive_path(table, id_greenhouse, month)
+        archived = Counter()
+        if os.path.exists(path):
+            # Файл отсортирован по времени, поэтому читаются только группы строк из диапазона пачки
+            with pa.memory_map(path) as source:
+                in_range = pq.read_table(source, filters=[
+                    ("timestamp", ">=", min(row[0] for row in group)),
+                    ("timestamp", "<=", max(row[0] for row in group)),
+                ])
+            archived = Counter(zip(*(in_range[name].to_pylist() for name in schema.names)))
+        # Строки без идентификатора сравниваются как мультимножества (время, датчик, значение)
+        missing = Counter(group) - archived
+        if missing:
+            _merge_into_archive(table, id_greenhouse, month, list(missing.elements()))
+            added += sum(missing.values())
+            print(f"Archived {sum(missing.values())} late rows of {table} for {month:%Y-%m}, greenhouse {id_greenhouse}")
+    return added
+
+
+def ensure_partition_archived(table: str, partition: str) -> int:
+    key_column, value_column, _ = ARCHIVE_TABLES[table]
+    checked = 0
+    # Строки читаются по времени порциями, чтобы память не зависела от размера секции
+    with ingest_engine.connect() as connection:
+        result = connection.execution_options(yield_per=ARCHIVE_BATCH_SIZE).execute(text(
+            f'SELECT "timestamp", id_greenhouse, {key_column}, {value_column} FROM "{partition}" ORDER BY "timestamp"'
+        ))
+        for chunk in result.partitions():
+            ensure_archived(table, chunk)
+            checked += len(chunk)
+    return checked
+
+if __name__ == "__main__":
+    print(f"Archived rows: {archive_closed_months()}")
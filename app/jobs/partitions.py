@@ -0,0 +1,215 @@
+# Обслуживание секций таблиц истории: python -m app.jobs.partitions [maintain|migrate]
+import argparse
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.dependencies import ingest_engine
+from app.models.greenhouse import Greenhouse
+from app.models.sensor_reading import SensorReading
+from app.models.device_state import DeviceState
+from app.models.sensor import Sensor
+from app.models.device import Device
+from app.models.user import User
+from app.models.fcm_token import FCMToken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+# Сколько месяцев секции остаются подключёнными; 0 — не отключать
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", 0))
+# Как часто процесс приёма проверяет наличие секций наперёд, сек
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 3600))
+# Ключ рекомендательной блокировки: секции одновременно создаёт только один процесс
+PARTITION_LOCK_KEY = 7412003
+
+PARTITIONED_MODELS = [SensorReading, DeviceState]
+
+
+def month_start(timestamp: datetime, offset: int = 0) -> datetime:
+    index = timestamp.year * 12 + timestamp.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_{start:%Y_%m}"
+
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    return connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": table},
+    ).first() is not None
+
+
+def attached_partitions(connection: Connection, table: str) -> list:
+    rows = connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table)"
+        ),
+        {"table": table},
+    )
+    return sorted(row.relname for row in rows)
+
+
+def _default_has_rows(connection: Connection, default: str, bounds: dict) -> bool:
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": default}).scalar() is None:
+        return False
+    return connection.execute(
+        text(f'SELECT 1 FROM "{default}" WHERE "timestamp" >= :start AND "timestamp" < :end LIMIT 1'), bounds
+    ).first() is not None
+
+
+def create_partition(connection: Connection, table: str, start: datetime):
+    name = partition_name(table, start)
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return
+    end = month_start(start, 1)
+    default = f"{table}_default"
+    bounds = {"start": start, "end": end}
+    # Если секция не была создана вовремя, строки месяца лежат в секции по умолчанию, и PostgreSQL
+    # не создаст новую секцию, пока они там: секция по умолчанию отключается, строки переносятся
+    moved = _default_has_rows(connection, default, bounds)
+    if moved:
+        connection.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"'))
+    connection.execute(text(
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+    if moved:
+        rows = connection.execute(
+            text(f'INSERT INTO "{table}" SELECT * FROM "{default}" WHERE "timestamp" >= :start AND "timestamp" < :end'), bounds
+        ).rowcount
+        connection.execute(text(f'DELETE FROM "{default}" WHERE "timestamp" >= :start AND "timestamp" < :end'), bounds)
+        connection.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT'))
+        print(f"Moved {rows} rows from '{default}' to '{name}'")
+
+
+def ensure_partitions(connection: Connection, months_ahead: int = PARTITION_MONTHS_AHEAD, since: datetime = None):
+    if connection.dialect.name != "postgresql":
+        return
+    # Блокировка до конца транзакции: процессы приёма и команда maintain не создают секции одновременно
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    now = datetime.utcnow()
+    first = month_start(since or now)
+    for model in PARTITIONED_MODELS:
+        table = model.__tablename__
+        if not is_partitioned(connection, table):
+            continue
+        # Секция по умолчанию принимает строки вне созданных диапазонов (например, из журнала)
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{table}" DEFAULT'))
+        start = first
+        while start <= month_start(now, months_ahead):
+            create_partition(connection, table, start)
+            start = month_start(start, 1)
+
+
+def detach_old_partitions(connection: Connection, retention_months: int = PARTITION_RETENTION_MONTHS) -> list:
+    if connection.dialect.name != "postgresql" or retention_months <= 0:
+        return []
+    cutoff = month_start(datetime.utcnow(), -retention_months)
+    detached = []
+    for model in PARTITIONED_MODELS:
+        table = model.__tablename__
+        for name in attached_partitions(connection, table):
+            suffix = name[len(table) + 1:]
+            try:
+                start = datetime.strptime(suffix, "%Y_%m")
+            except ValueError:
+                continue
+            if month_start(start, 1) <= cutoff:
+                connection.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                detached.append(name)
+    return detached
+
+
+def migrate_to_partitions(connection: Connection):
+    for model in PARTITIONED_MODELS:
+        table = model.__tablename__
+        if is_partitioned(connection, table):
+            print(f"Таблица '{table}' уже секционирована.")
+            continue
+
+        legacy = f"{table}_unpartitioned"
+        connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{legacy}"'))
+        # Индексы (включая первичный ключ) переименовываются, чтобы освободить имена для новой таблицы
+        for row in connection.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": legacy}
+        ).all():
+            connection.execute(text(f'ALTER INDEX "{row.indexname}" RENAME TO "{row.indexname}_unpartitioned"'))
+
+        model.__table__.create(connection)
+        since = connection.execute(text(f'SELECT min("timestamp") FROM "{legacy}"')).scalar()
+        ensure_partitions(connection, since=since)
+
+        columns = ", ".join(f'"{column.name}"' for column in model.__table__.columns)
+        connection.execute(text(
+            f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{legacy}" WHERE "timestamp" IS NOT NULL'
+        ))
+        id_column = model.__table__.primary_key.columns.values()[0].name
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{id_column}'), "
+            f'coalesce((SELECT max("{id_column}") FROM "{table}"), 0) + 1, false)'
+        ))
+        print(f"Таблица '{table}' секционирована, исходные данные сохранены в '{legacy}'.")
+
+
+class PartitionMaintenance:
+    """Периодически создаёт секции наперёд в процессе приёма, не полагаясь только на запуск и maintain."""
+
+    def __init__(self, interval: float = PARTITION_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def run_once(self):
+        with ingest_engine.begin() as connection:
+            ensure_partitions(connection)
+        self.last_run = datetime.utcnow()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in partition maintenance: {e}")
+
+    def stats(self) -> dict:
+        return {"last_run": self.last_run.isoformat() if self.last_run else None}
+
+
+partition_maintenance = PartitionMaintenance()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание секций таблиц истории")
+    parser.add_argument("command", nargs="?", default="maintain", choices=["maintain", "migrate"])
+    args = parser.parse_args()
+
+    with ingest_engine.begin() as connection:
+        if args.command == "migrate":
+            migrate_to_partitions(connection)
+        ensure_partitions(connection)
+        for name in detach_old_partitions(connection):
+            print(f"Секция '{name}' отключена.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# Очистка устаревших сырых данных: python -m app.jobs.retention
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from app.dependencies import ingest_engine
+from app.jobs.partitions import attached_partitions, month_start
+from app.models.greenhouse import Greenhouse
+from app.models.sensor_reading import SensorReading
+from app.models.device_state import DeviceState
+from app.models.setting import Setting
+from app.models.user import User
+from app.models.fcm_token import FCMToken
+from app.models.retention_watermark import RetentionWatermark
+from app.utils.archive import ARCHIVE_ENABLED
+from app.utils.history import RETENTION_RAW_DAYS, raw_retention_cutoff
+from app.jobs.archive import archive_closed_months, ensure_archived, ensure_partition_archived
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 5000))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", 0.1))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))
+RETENTION_LOCK_TIMEOUT = int(os.getenv("RETENTION_LOCK_TIMEOUT", 5000))
+# Ключ рекомендательной блокировки: задачу одновременно выполняет только один процесс
+RETENTION_LOCK_KEY = 7412001
+
+# Таблица -> (первичный ключ, столбец устройства/параметра, столбец значения)
+COMPACTED_TABLES = {
+    DeviceState.__tablename__: ("id_dstate", "id_device", "state"),
+    Setting.__tablename__: ("id_setting", "id_parameter", "value"),
+}
+
+
+def drop_expired_partitions(cutoff: datetime) -> int:
+    reclaimed = 0
+    table = SensorReading.__tablename__
+    with ingest_engine.begin() as connection:
+        names = attached_partitions(connection, table)
+    for name in names:
+        try:
+            start = datetime.strptime(name[len(table) + 1:], "%Y_%m")
+        except ValueError:
+            continue
+        if month_start(start, 1) > cutoff:
+            continue
+        archived = ensure_partition_archived(table, name) if ARCHIVE_ENABLED else None
+        try:
+            with ingest_engine.connect() as connection, connection.begin() as transaction:
+                # Ожидающий DETACH блокирует вставки в таблицу, поэтому ждём блокировку недолго;
+                # если секция занята, её строки будут удалены пачками
+                connection.execute(text(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}ms'"))
+                connection.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                # После DETACH в секцию уже ничего не вставляется, поэтому число строк окончательное
+                rows = connection.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+                if archived is not None and rows != archived:
+                    # После сверки с архивом в секцию пришли строки: проверим её в следующий запуск
+                    transaction.rollback()
+                    print(f"Partition {name} changed during archive check, skipping drop")
+                    continue
+                connection.execute(text(f'DROP TABLE "{name}"'))
+            reclaimed += rows
+        except OperationalError as e:
+            print(f"Partition {name} is busy, skipping drop: {e}")
+    return reclaimed
+
+
+def _delete_archived_batch(cutoff: datetime) -> int:
+    with ingest_engine.begin() as connection:
+        rows = connection.execute(
+            text(
+                'SELECT id_sreading, "timestamp", id_greenhouse, id_sensor, value FROM sensor_reading '
+                'WHERE "timestamp" < :cutoff LIMIT :limit'
+            ),
+            {"cutoff": cutoff, "limit": RETENTION_BATCH_SIZE},
+        ).all()
+    if not rows:
+        return 0
+    ensure_archived(SensorReading.__tablename__, [row[1:] for row in rows])
+    # Удаляются ровно сверенные с архивом строки; пришедшие тем временем останутся до следующей пачки
+    with ingest_engine.begin() as connection:
+        return connection.execute(
+            text(
+                'DELETE FROM sensor_reading WHERE id_sreading = ANY(:ids) '
+                'AND "timestamp" >= :first AND "timestamp" <= :last'
+            ),
+            {"ids": [row.id_sreading for row in rows], "first": min(row.timestamp for row in rows), "last": max(row.timestamp for row in rows)},
+        ).rowcount
+
+
+def delete_expired_readings(cutoff: datetime) -> int:
+    reclaimed = 0
+    while True:
+        # Короткие транзакции по RETENTION_BATCH_SIZE строк не держат долгих блокировок
+        if ARCHIVE_ENABLED:
+            deleted = _delete_archived_batch(cutoff)
+        else:
+            with ingest_engine.begin() as connection:
+                deleted = connection.execute(
+                    text(
+                        'DELETE FROM sensor_reading WHERE (id_sreading, "timestamp") IN ('
+                        'SELECT id_sreading, "timestamp" FROM sensor_reading WHERE "timestamp" < :cutoff LIMIT :limit)'
+                    ),
+                    {"cutoff": cutoff, "limit": RETENTION_BATCH_SIZE},
+                ).rowcount
+        reclaimed += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            return reclaimed
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+
+def ensure_compaction_indexes(connection: Connection):
+    # Индекс по времени нужен, чтобы сжатие читало только свои сутки; в старых базах его не было
+    for index in Setting.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _save_watermark(table: str, compacted_until: datetime):
+    stmt = insert(RetentionWatermark).values(table_name=table, compacted_until=compacted_until)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["table_name"], set_={"compacted_until": stmt.excluded.compacted_until}
+    )
+    with ingest_engine.begin() as connection:
+        connection.execute(stmt)
+
+
+def compact_duplicates(table: str, cutoff: datetime) -> int:
+    id_column, key_column, value_column = COMPACTED_TABLES[table]
+    # Сжимается только [прошлая граница, cutoff); при первом запуске — вся история до cutoff
+    with ingest_engine.begin() as connection:
+        since = connection.execute(
+            select(RetentionWatermark.compacted_until).where(RetentionWatermark.table_name == table)
+        ).scalar()
+        if since is None:
+            since = connection.execute(
+                text(f'SELECT min("timestamp") FROM "{table}" WHERE "timestamp" < :cutoff'), {"cutoff": cutoff}
+            ).scalar()
+    if since is None or since >= cutoff:
+        return 0
+
+    # Повторы ищутся посуточно; первая строка суток всегда сохраняется
+    statement = text(
+        f'DELETE FROM "{table}" WHERE ({id_column}, "timestamp") IN ('
+        f'SELECT {id_column}, "timestamp" FROM ('
+        f'SELECT {id_column}, "timestamp", {value_column} AS current_value, '
+        f'lag({value_column}) OVER (PARTITION BY id_greenhouse, {key_column} ORDER BY "timestamp", {id_column}) AS previous_value '
+        f'FROM "{table}" WHERE "timestamp" >= :start AND "timestamp" < :end'
+        f') ordered WHERE previous_value = current_value LIMIT :limit)'
+    )
+    reclaimed = 0
+    start = since
+    while start < cutoff:
+        end = min(start.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1), cutoff)
+        while True:
+            with ingest_engine.begin() as connection:
+                deleted = connection.execute(
+                    statement, {"start": start, "end": end, "limit": RETENTION_BATCH_SIZE}
+                ).rowcount
+            reclaimed += deleted
+            if deleted < RETENTION_BATCH_SIZE:
+                break
+            time.sleep(RETENTION_BATCH_PAUSE)
+        # Граница сохраняется после каждых суток, чтобы прерванный запуск не начинал сначала
+        _save_watermark(table, end)
+        start = end
+    return reclaimed
+
+
+def run_retention() -> dict:
+    cutoff = raw_retention_cutoff()
+    if cutoff is None or ingest_engine.dialect.name != "postgresql":
+        return {}
+
+    with ingest_engine.connect() as lock_connection:
+        if not lock_connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY}).scalar():
+            print("Retention job is already running in another process")
+            return {}
+        try:
+            # Строки удаляются только после выгрузки их месяца в архив
+            if ARCHIVE_ENABLED:
+                archive_closed_months()
+            reclaimed = {
+                SensorReading.__tablename__: drop_expired_partitions(cutoff) + delete_expired_readings(cutoff),
+            }
+            for table in COMPACTED_TABLES:
+                reclaimed[table] = compact_duplicates(table, cutoff)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+            lock_connection.commit()
+    return reclaimed
+
+
+class RetentionJob:
+    def __init__(self, interval: float = RETENTION_INTERVAL):
+        self.interval = interval
+        self.last_run = None
+        self.last_reclaimed = {}
+        self.total_reclaimed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if RETENTION_RAW_DAYS <= 0:
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention-job", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def run_once(self) -> dict:
+        reclaimed = run_retention()
+        self.last_run = datetime.utcnow()
+        self.last_reclaimed = reclaimed
+        self.total_reclaimed += sum(reclaimed.values())
+        if any(reclaimed.values()):
+            print(f"Retention job reclaimed rows: {reclaimed}")
+        return reclaimed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in retention job: {e}")
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_reclaimed": self.last_reclaimed,
+            "total_reclaimed": self.total_reclaimed,
+        }
+
+
+retention_job = RetentionJob()
+
+
+if __name__ == "__main__":
+    print(f"Reclaimed rows: {retention_job.run_once()}")
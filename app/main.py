@@ -1,7 +1,8 @@
 from fastapi import FastAPI
-from app.routers import users, greenhouses, sensor_readings, device_states, settings
-from app.dependencies import Base, engine
-from app.external_services.mqtt import start_mqtt_listener
+from app.routers import users, greenhouses, sensor_readings, device_states, settings, metrics
+from app.dependencies import Base, engine, async_engine
+from app.external_services.email import email_outbox
+from app.external_services.mqtt import start_mqtt_listener, start_mqtt_publisher, stop_mqtt_listener
 from app.models.greenhouse import Greenhouse
 from app.models.sensor_reading import SensorReading
 from app.models.device_state import DeviceState
@@ -12,12 +13,47 @@ from app.models.fcm_token import FCMToken
 from app.models.parameter import Parameter
 from app.models.setting import Setting
 from app.models.sensor_alert_state import SensorAlertState
+from app.models.sensor_latest import SensorLatest
+from app.models.device_state_latest import DeviceStateLatest
+from app.models.setting_latest import SettingLatest
+from app.models.sensor_reading_rollup import SensorReadingHourly, SensorReadingDaily
+from app.models.retention_watermark import RetentionWatermark
+from app.models.revoked_token import RevokedToken
+from app.utils.greenhouse_cache import greenhouse_listener
+from app.utils.reference_data import reference_data
+from app.utils.token_denylist import token_denylist
+from app.utils.password_hashing import shutdown_password_pool
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+# При запуске приёма отдельным процессом (python -m app.ingest) установите MQTT_INGEST_IN_API=false
+MQTT_INGEST_IN_API = os.getenv("MQTT_INGEST_IN_API", "true").lower() in ("1", "true", "yes")
 
 app = FastAPI()
 @app.get("/")
 async def home():
    return {"data": "Hello World"}
 
+@app.on_event("startup")
+def start_background_workers():
+    reference_data.reload()
+    greenhouse_listener.start()
+    token_denylist.start()
+    email_outbox.start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    token_denylist.stop()
+    greenhouse_listener.stop()
+    email_outbox.stop()
+    shutdown_password_pool()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
 # Создание таблиц
 Base.metadata.create_all(bind=engine)
 
@@ -26,5 +62,12 @@ app.include_router(greenhouses.router, prefix="/greenhouses", tags=["Greenhouses
 app.include_router(sensor_readings.router, prefix="/sensor-readings", tags=["Sensor Readings"])
 app.include_router(device_states.router, prefix="/device-states", tags=["Device States"])
 app.include_router(settings.router, prefix="/settings", tags=["Settings"])
+if metrics.METRICS_TOKEN:
+    app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
 
-start_mqtt_listener()
\ No newline at end of file
+if MQTT_INGEST_IN_API:
+    start_mqtt_listener()
+    # При остановке сервера записываются буферизованные показания и отправляются уведомления из очереди
+    app.add_event_handler("shutdown", stop_mqtt_listener)
+else:
+    start_mqtt_publisher()
@@ -1,11 +1,16 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Boolean, Index
 from app.dependencies import Base
 from datetime import datetime
 
 class DeviceState(Base):
     __tablename__ = "device_state"
-    id_dstate = Column(Integer, primary_key=True, index=True)
+    # В PostgreSQL таблица секционирована по месяцам (см. app/jobs/partitions.py)
+    __table_args__ = (
+        Index("ix_device_state_greenhouse_device_timestamp", "id_greenhouse", "id_device", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id_dstate = Column(Integer, primary_key=True, index=True, autoincrement=True)
     id_device = Column(Integer, ForeignKey("device.id_device"), nullable=False)
     id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), nullable=False)
     state = Column(Boolean, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Boolean
+from app.dependencies import Base
+
+class DeviceStateLatest(Base):
+    __tablename__ = "device_state_latest"
+    id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), primary_key=True)
+    id_device = Column(Integer, ForeignKey("device.id_device"), primary_key=True)
+    state = Column(Boolean, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
@@ -0,0 +1,8 @@
+from sqlalchemy import Column, String, DateTime
+from app.dependencies import Base
+
+class RetentionWatermark(Base):
+    # Граница, до которой в таблице уже убраны повторы значений
+    __tablename__ = "retention_watermark"
+    table_name = Column(String, primary_key=True)
+    compacted_until = Column(DateTime, nullable=False)
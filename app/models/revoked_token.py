@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from app.dependencies import Base
+
+class RevokedToken(Base):
+    # Запись отзывает либо один токен (jti), либо все токены пользователя, выданные до revoked_at
+    __tablename__ = "revoked_token"
+    id_revoked = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, nullable=True, unique=True)
+    id_user = Column(Integer, ForeignKey("user.id_user", ondelete="CASCADE"), nullable=True)
+    revoked_at = Column(DateTime, nullable=False)
+    # После истечения срока действия отозванных токенов запись больше не нужна
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from app.dependencies import Base
+
+class SensorLatest(Base):
+    __tablename__ = "sensor_latest"
+    id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), primary_key=True)
+    id_sensor = Column(Integer, ForeignKey("sensor.id_sensor"), primary_key=True)
+    value = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
@@ -1,11 +1,17 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index
 from app.dependencies import Base
 from datetime import datetime
 
 class SensorReading(Base):
     __tablename__ = "sensor_reading"
-    id_sreading = Column(Integer, primary_key=True, index=True)
+    # В PostgreSQL таблица секционирована по месяцам (см. app/jobs/partitions.py),
+    # поэтому ключ секционирования входит в первичный ключ
+    __table_args__ = (
+        Index("ix_sensor_reading_greenhouse_sensor_timestamp", "id_greenhouse", "id_sensor", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id_sreading = Column(Integer, primary_key=True, index=True, autoincrement=True)
     id_sensor = Column(Integer, ForeignKey("sensor.id_sensor"), nullable=False)
     id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), nullable=False)
     value = Column(Integer, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, ForeignKey
+from app.dependencies import Base
+
+class SensorReadingHourly(Base):
+    __tablename__ = "sensor_reading_hourly"
+    id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), primary_key=True)
+    id_sensor = Column(Integer, ForeignKey("sensor.id_sensor"), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    value_sum = Column(BigInteger, nullable=False)
+    value_count = Column(Integer, nullable=False)
+    value_min = Column(Integer, nullable=False)
+    value_max = Column(Integer, nullable=False)
+
+class SensorReadingDaily(Base):
+    __tablename__ = "sensor_reading_daily"
+    id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), primary_key=True)
+    id_sensor = Column(Integer, ForeignKey("sensor.id_sensor"), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    value_sum = Column(BigInteger, nullable=False)
+    value_count = Column(Integer, nullable=False)
+    value_min = Column(Integer, nullable=False)
+    value_max = Column(Integer, nullable=False)
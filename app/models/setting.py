@@ -8,4 +8,4 @@ class Setting(Base):
     id_parameter = Column(Integer, ForeignKey("parameter.id_parameter"), nullable=False)
     id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), nullable=False)
     value = Column(Integer, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
\ No newline at end of file
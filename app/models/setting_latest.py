@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from app.dependencies import Base
+
+class SettingLatest(Base):
+    __tablename__ = "setting_latest"
+    id_greenhouse = Column(Integer, ForeignKey("greenhouse.id_greenhouse"), primary_key=True)
+    id_parameter = Column(Integer, ForeignKey("parameter.id_parameter"), primary_key=True)
+    value = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
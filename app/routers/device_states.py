@@ -1,60 +1,31 @@
 from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
-from app.models.device_state import DeviceState
-from app.models.device import Device
-from app.models.greenhouse import Greenhouse
-from app.dependencies import get_db
-from sqlalchemy.sql import func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.device_state_latest import DeviceStateLatest
+from app.dependencies import get_async_db
 from fastapi.responses import JSONResponse
 from app.external_services.mqtt import publish_to_mqtt
-from app.utils.authentication import get_current_user, auth_scheme
-from fastapi.security import HTTPAuthorizationCredentials
+from app.utils.greenhouse_access import get_owned_greenhouse_async, get_owned_greenhouse_for_update
+from app.utils.greenhouse_cache import ResolvedGreenhouse
+from app.utils.reference_data import reference_data
 
 router = APIRouter()
 
 @router.get("/{guid}")
-def get_latest_device_states(
+async def get_latest_device_states(
     guid: str,
-    db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    db: AsyncSession = Depends(get_async_db),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_async),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
+    device_labels = reference_data.devices.by_id
+    latest_states = [
+        (device_labels[state.id_device], state.state)
+        for state in await db.execute(
+            select(DeviceStateLatest.id_device, DeviceStateLatest.state)
+            .where(DeviceStateLatest.id_greenhouse == greenhouse.id_greenhouse)
         )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    subquery = (
-        db.query(
-            DeviceState.id_device,
-            func.max(DeviceState.timestamp).label("latest_timestamp"),
-        )
-        .filter(DeviceState.id_greenhouse == greenhouse.id_greenhouse)
-        .group_by(DeviceState.id_device)
-        .subquery()
-    )
-
-    latest_states = (
-        db.query(DeviceState, Device.label)
-        .join(
-            subquery,
-            (DeviceState.id_device == subquery.c.id_device) &
-            (DeviceState.timestamp == subquery.c.latest_timestamp),
-        )
-        .join(Device, Device.id_device == DeviceState.id_device)
-        .all()
-    )
+        if state.id_device in device_labels
+    ]
 
     if not latest_states:
         raise HTTPException(
@@ -66,10 +37,10 @@ def get_latest_device_states(
     response_data = {
         "latest_device_states": [
             {
-                "device_label": state[1],
-                "state": state[0].state,
+                "device_label": label,
+                "state": state,
             }
-            for state in latest_states
+            for label, state in latest_states
         ],
     }
 
@@ -84,26 +55,8 @@ def control_device(
     guid: str,
     control_name: str,
     state: int,
-    db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_for_update),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
     mqtt_topic = f"m/{guid}/c/{control_name}"
 
     try:
@@ -122,26 +75,8 @@ def control_device(
 @router.post("/{guid}/demo")
 def control_device(
     guid: str,
-    db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_for_update),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
     mqtt_topic = f"m/{guid}/c/demo"
 
     try:
@@ -1,21 +1,29 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.schemas.greenhouse import GreenhouseBind, GreenhouseUnbind, GreenhouseUpdate
 from app.models.greenhouse import Greenhouse
-from app.dependencies import get_db
-from app.utils.authentication import get_current_user, auth_scheme
+from app.dependencies import get_db, get_async_db
+from app.utils.authentication import get_current_user, get_current_user_async, auth_scheme
+from app.utils.greenhouse_access import get_owned_greenhouse_for_update
+from app.utils.greenhouse_cache import ResolvedGreenhouse, invalidate_greenhouse, notify_greenhouse_changed
 from fastapi.security import HTTPAuthorizationCredentials
 
 router = APIRouter()
 
 @router.get("/my")
-def get_user_greenhouses(
-    db: Session = Depends(get_db),
+async def get_user_greenhouses(
+    db: AsyncSession = Depends(get_async_db),
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
-    user_id = get_current_user(token, db)
-    greenhouses = db.query(Greenhouse).filter(Greenhouse.id_user == user_id).order_by(Greenhouse.id_greenhouse).all()
+    user_id = await get_current_user_async(token, db)
+    greenhouses = (
+        await db.execute(
+            select(Greenhouse.guid, Greenhouse.title).where(Greenhouse.id_user == user_id).order_by(Greenhouse.id_greenhouse)
+        )
+    ).all()
     result = [{"guid": gh.guid, "title": gh.title} for gh in greenhouses]
 
     return JSONResponse(
@@ -52,7 +60,9 @@ def bind_greenhouse(
         )
 
     greenhouse.id_user = user_id
+    notify_greenhouse_changed(db, greenhouse.guid)
     db.commit()
+    invalidate_greenhouse(greenhouse.guid)
 
     return JSONResponse(
         content={"message": "Теплица успешно привязана"},
@@ -85,7 +95,9 @@ def unbind_greenhouse(
         )
 
     greenhouse.id_user = None
+    notify_greenhouse_changed(db, greenhouse.guid)
     db.commit()
+    invalidate_greenhouse(greenhouse.guid)
 
     return JSONResponse(
         content={"message": "Теплица успешно отвязана"},
@@ -97,30 +109,26 @@ def update_greenhouse_title(
     guid: str,
     greenhouse_update: GreenhouseUpdate,
     db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_for_update),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
+    # Владелец в условии обновления: теплицу могли отвязать между проверкой и записью
+    updated = (
+        db.query(Greenhouse)
+        .filter(Greenhouse.id_greenhouse == greenhouse.id_greenhouse, Greenhouse.id_user == greenhouse.id_user)
+        .update({Greenhouse.title: greenhouse_update.title})
+    )
+    notify_greenhouse_changed(db, guid)
+    db.commit()
+    invalidate_greenhouse(guid)
 
-    if greenhouse.id_user != user_id:
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Доступ запрещён",
             headers={"Content-Type": "application/json; charset=utf-8"},
         )
 
-    greenhouse.title = greenhouse_update.title
-    db.commit()
-
     return JSONResponse(
         content={"message": "Название теплицы успешно обновлено"},
         headers={"Content-Type": "application/json; charset=utf-8"},
-    )
\ No newline at end of file
+    )
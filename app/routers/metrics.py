@@ -0,0 +1,63 @@
+import hmac
+import os
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from app.dependencies import get_pool_stats
+from app.external_services.email import email_outbox
+from app.external_services.mqtt import get_ingest_stats
+from app.utils.authentication import auth_scheme, token_cache_stats
+from app.utils.password_hashing import password_pool_stats
+from app.utils.history_cache import history_cache_stats
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# Метрики раскрывают внутреннее состояние пулов и приёма, поэтому доступны только по отдельному токену;
+# без значения маршруты /metrics не подключаются
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def verify_metrics_token(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
+    if not METRICS_TOKEN or not hmac.compare_digest(token.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ к метрикам запрещён",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+router = APIRouter(dependencies=[Depends(verify_metrics_token)])
+
+@router.get("/ingest")
+def get_ingest_metrics():
+    return JSONResponse(
+        content=get_ingest_stats(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/history-cache")
+def get_history_cache_metrics():
+    return JSONResponse(
+        content=history_cache_stats(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/db-pool")
+def get_db_pool_metrics():
+    return JSONResponse(
+        content=get_pool_stats(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/auth")
+def get_auth_metrics():
+    return JSONResponse(
+        content={"tokens": token_cache_stats(), "password_hashing": password_pool_stats()},
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/email")
+def get_email_metrics():
+    return JSONResponse(
+        content=email_outbox.stats(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
@@ -1,85 +1,211 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Query
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models.sensor_reading import SensorReading
-from app.models.sensor import Sensor
-from app.models.greenhouse import Greenhouse
-from app.dependencies import get_db
-from sqlalchemy.sql import func
-from fastapi.responses import JSONResponse
-from app.utils.authentication import get_current_user, auth_scheme
-from fastapi.security import HTTPAuthorizationCredentials
-from datetime import datetime, timedelta
+from app.models.sensor_latest import SensorLatest
+from app.dependencies import get_db, get_async_db
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.utils.greenhouse_access import get_owned_greenhouse, get_owned_greenhouse_async
+from app.utils.greenhouse_cache import ResolvedGreenhouse
+from app.utils.history import load_readings, load_series
+from app.utils.reference_data import reference_data
+from app.utils.history_cache import cached_history, etag_response
+from app.utils.downsampling import lttb
+from app.utils.export import EXPORT_FORMATS, iter_readings
+from app.utils.statistics import sensor_statistics
+from app.utils.threshold_engine import upper_threshold
+from typing import List
+from datetime import datetime, timedelta, timezone
 
 router = APIRouter()
 
+def _to_utc(value: datetime) -> datetime:
+    # Время в базе хранится в UTC без часового пояса
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 @router.get("/{guid}")
-def get_latest_sensor_readings(
+async def get_latest_sensor_readings(
     guid: str,
+    db: AsyncSession = Depends(get_async_db),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_async),
+):
+    sensor_labels = reference_data.sensors.by_id
+    latest_readings = [
+        (sensor_labels[reading.id_sensor], reading.value)
+        for reading in await db.execute(
+            select(SensorLatest.id_sensor, SensorLatest.value).where(SensorLatest.id_greenhouse == greenhouse.id_greenhouse)
+        )
+        if reading.id_sensor in sensor_labels
+    ]
+
+    if not latest_readings:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Данные с датчиков не найдены",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    response_data = {
+        "latest_readings": [
+            {
+                "sensor_label": label,
+                "value": value,
+            }
+            for label, value in latest_readings
+        ],
+    }
+
+    return JSONResponse(
+        content=response_data,
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/{guid}/history")
+def get_sensors_history(
+    request: Request,
+    guid: str,
+    month: int = Query(..., ge=1, le=12),
+    day: int = Query(None, ge=1, le=31),
+    labels: List[str] = Query(None),
     db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse),
 ):
-    user_id = get_current_user(token, db)
+    # Без списка меток возвращаются ряды всех датчиков
+    sensor_ids = reference_data.sensors.by_label
+    if labels:
+        sensors = {sensor_ids[label]: label for label in labels if label in sensor_ids}
+    else:
+        sensors = dict(reference_data.sensors.by_id)
 
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
+    if not sensors or (labels and len(sensors) < len(set(labels))):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
+            detail="Датчик не найден",
             headers={"Content-Type": "application/json; charset=utf-8"},
         )
 
-    if greenhouse.id_user != user_id:
+    history = cached_history(db, greenhouse.id_greenhouse, list(sensors), datetime.utcnow().year, month, day)
+
+    return etag_response(request, {"data": {sensors[id_sensor]: history[id_sensor] for id_sensor in sensors}})
+
+@router.get("/{guid}/export")
+def export_sensor_readings(
+    guid: str,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    labels: List[str] = Query(None),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse),
+):
+    sensor_ids = reference_data.sensors.by_label
+    if labels:
+        sensors = {sensor_ids[label]: label for label in labels if label in sensor_ids}
+    else:
+        sensors = dict(reference_data.sensors.by_id)
+
+    if not sensors or (labels and len(sensors) < len(set(labels))):
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Датчик не найден",
             headers={"Content-Type": "application/json; charset=utf-8"},
         )
 
-    subquery = (
-        db.query(
-            SensorReading.id_sensor,
-            func.max(SensorReading.timestamp).label("latest_timestamp"),
+    start, end = _to_utc(start), _to_utc(end)
+
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Начало периода должно быть раньше конца",
+            headers={"Content-Type": "application/json; charset=utf-8"},
         )
-        .filter(SensorReading.id_greenhouse == greenhouse.id_greenhouse)
-        .group_by(SensorReading.id_sensor)
-        .subquery()
+
+    # Строки читаются серверным курсором и отдаются клиенту по мере чтения
+    writer, media_type = EXPORT_FORMATS[format]
+    filename = f"{guid}_{start:%Y%m%d%H%M}_{end:%Y%m%d%H%M}.{format}"
+    return StreamingResponse(
+        writer(iter_readings(greenhouse.id_greenhouse, sensors, start, end)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
-    latest_readings = (
-        db.query(SensorReading, Sensor.label)
-        .join(
-            subquery,
-            (SensorReading.id_sensor == subquery.c.id_sensor) &
-            (SensorReading.timestamp == subquery.c.latest_timestamp),
+@router.get("/{guid}/{label}/stats")
+def get_sensor_stats(
+    guid: str,
+    label: str,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    threshold: float = Query(None),
+    db: Session = Depends(get_db),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse),
+):
+    id_sensor = reference_data.sensors.id(label)
+    if id_sensor is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Датчик не найден",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    start, end = _to_utc(start), _to_utc(end)
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Начало периода должно быть раньше конца",
+            headers={"Content-Type": "application/json; charset=utf-8"},
         )
-        .join(Sensor, Sensor.id_sensor == SensorReading.id_sensor)
-        .all()
+
+    # Без явного порога используется текущая верхняя граница из настроек теплицы
+    if threshold is None:
+        threshold = upper_threshold(db, greenhouse.id_greenhouse, label)
+
+    result = sensor_statistics(db, greenhouse.id_greenhouse, id_sensor, start, end, threshold)
+
+    return JSONResponse(
+        content={"data": result},
+        headers={"Content-Type": "application/json; charset=utf-8"},
     )
 
-    if not latest_readings:
+@router.get("/{guid}/{label}/series")
+def get_sensor_series(
+    guid: str,
+    label: str,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    points: int = Query(500, ge=3, le=5000),
+    db: Session = Depends(get_db),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse),
+):
+    id_sensor = reference_data.sensors.id(label)
+    if id_sensor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Данные с датчиков не найдены",
+            detail="Датчик не найден",
             headers={"Content-Type": "application/json; charset=utf-8"},
         )
 
-    response_data = {
-        "latest_readings": [
-            {
-                "sensor_label": reading[1],
-                "value": reading[0].value,
-            }
-            for reading in latest_readings
-        ],
-    }
+    start, end = _to_utc(start), _to_utc(end)
+
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Начало периода должно быть раньше конца",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    readings = lttb(load_series(db, greenhouse.id_greenhouse, id_sensor, start, end, points), points)
+
+    result = {timestamp.strftime("%Y-%m-%d %H:%M:%S"): value for timestamp, value in readings}
 
     return JSONResponse(
-        content=response_data,
+        content={"data": result},
         headers={"Content-Type": "application/json; charset=utf-8"},
     )
 
 @router.get("/{guid}/{label}")
 def get_sensor_data(
+    request: Request,
     guid: str,
     label: str,
     month: int = Query(..., ge=1, le=12),
@@ -87,27 +213,16 @@ def get_sensor_data(
     start_hour: int = Query(None, ge=0, le=23),
     end_hour: int = Query(None, ge=0, le=23),
     db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme)
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
+    id_sensor = reference_data.sensors.id(label)
+    if id_sensor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
+            detail="Датчик не найден",
             headers={"Content-Type": "application/json; charset=utf-8"},
         )
 
-    sensor = db.query(Sensor).filter(Sensor.label == label).first()
-    id_sensor = sensor.id_sensor
     year = datetime.utcnow().year
 
     # Если указан диапазон часов, возвращаем данные за этот диапазон
@@ -115,14 +230,15 @@ def get_sensor_data(
         start_time = datetime(year, month, day, start_hour, 0)
         end_time = datetime(year, month, day, end_hour, 0)
 
-        readings = db.query(SensorReading).filter(
-            SensorReading.id_sensor == id_sensor,
-            SensorReading.id_greenhouse == greenhouse.id_greenhouse,
-            SensorReading.timestamp >= start_time,
-            SensorReading.timestamp < end_time + timedelta(hours=1)
-        ).all()
+        readings = load_readings(
+            db,
+            greenhouse.id_greenhouse,
+            id_sensor,
+            start_time,
+            end_time + timedelta(hours=1),
+        )
 
-        result = {reading.timestamp.strftime("%Y-%m-%d %H:%M:%S"): reading.value for reading in readings}
+        result = {timestamp.strftime("%Y-%m-%d %H:%M:%S"): value for timestamp, value in readings}
 
         return JSONResponse(
             content={"data": result},
@@ -131,82 +247,15 @@ def get_sensor_data(
 
     # Если указан только день, считаем среднее по каждому часу
     elif day is not None and start_hour is None and end_hour is None:
-        start_hour = datetime(year, month, day, 0, 0)
-        end_hour = datetime(year, month, day, 23, 59)
-
-        hourly_data = (
-            db.query(
-                func.date_trunc('hour', SensorReading.timestamp).label("hour"),
-                func.avg(SensorReading.value).label("avg_value"),
-                func.count(SensorReading.value).label("count")
-            )
-            .filter(
-                SensorReading.id_sensor == id_sensor,
-                SensorReading.id_greenhouse == greenhouse.id_greenhouse,
-                SensorReading.timestamp >= start_hour,
-                SensorReading.timestamp <= end_hour
-            )
-            .group_by("hour")
-            .order_by("hour")
-            .all()
-        )
-
-        result = {f"{year}-{month:02d}-{day:02d} {hour:02d}:00-{hour + 1:02d}:00": 0 for hour in range(24)}
-
-        # Заполняем данные, если измерений больше 50
-        for hour, avg_value, count in hourly_data:
-            hour_str = f"{hour.strftime('%Y-%m-%d %H:00')}-{(hour + timedelta(hours=1)).strftime('%H:00')}"
-            result[hour_str] = round(float(avg_value), 1) if count > 5 else 0
-
-        if all(value == 0 for value in result.values()):
-            return JSONResponse(
-                content={"data": {}},
-                headers={"Content-Type": "application/json; charset=utf-8"}
-            )
+        result = cached_history(db, greenhouse.id_greenhouse, [id_sensor], year, month, day)[id_sensor]
 
-        return JSONResponse(
-            content={"data": result},
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
+        return etag_response(request, {"data": result})
 
     # Если день не указан, считаем среднее значение за каждый день месяца
     elif day is None and start_hour is None and end_hour is None:
-        start_day = datetime(year, month, 1, 0, 0)
-        end_day = (datetime(year, month + 1, 1) - timedelta(days=1)).day  # Последний день месяца
-
-        daily_data = (
-            db.query(
-                func.date_trunc('day', SensorReading.timestamp).label("day"),
-                func.avg(SensorReading.value).label("avg_value"),
-                func.count(SensorReading.value).label("count")
-            )
-            .filter(
-                SensorReading.id_sensor == id_sensor,
-                SensorReading.id_greenhouse == greenhouse.id_greenhouse,
-                SensorReading.timestamp >= start_day,
-                SensorReading.timestamp < datetime(year, month, end_day, 23, 59, 59)
-            )
-            .group_by("day")
-            .order_by("day")
-            .all()
-        )
-
-        result = {f"{year}-{month:02d}-{day:02d}": 0 for day in range(1, end_day + 1)}
+        result = cached_history(db, greenhouse.id_greenhouse, [id_sensor], year, month)[id_sensor]
 
-        for day, avg_value, count in daily_data:
-            day_str = day.strftime("%Y-%m-%d")
-            result[day_str] = round(float(avg_value), 1) if count >= 12 else 0
-
-        if all(value == 0 for value in result.values()):
-            return JSONResponse(
-                content={"data": {}},
-                headers={"Content-Type": "application/json; charset=utf-8"}
-            )
-
-        return JSONResponse(
-            content={"data": result},
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
+        return etag_response(request, {"data": result})
 
     else:
         raise HTTPException(
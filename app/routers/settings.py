@@ -1,60 +1,31 @@
 from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
-from app.models.parameter import Parameter
-from app.models.setting import Setting
-from app.models.greenhouse import Greenhouse
-from app.dependencies import get_db
-from sqlalchemy.sql import func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.setting_latest import SettingLatest
+from app.dependencies import get_async_db
 from fastapi.responses import JSONResponse
-from app.utils.authentication import get_current_user, auth_scheme
-from fastapi.security import HTTPAuthorizationCredentials
+from app.utils.greenhouse_access import get_owned_greenhouse_async, get_owned_greenhouse_for_update
+from app.utils.greenhouse_cache import ResolvedGreenhouse
+from app.utils.reference_data import reference_data
 from app.external_services.mqtt import publish_to_mqtt
 
 router = APIRouter()
 
 @router.get("/{guid}")
-def get_latest_settings(
+async def get_latest_settings(
     guid: str,
-    db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    db: AsyncSession = Depends(get_async_db),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_async),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    subquery = (
-        db.query(
-            Setting.id_parameter,
-            func.max(Setting.timestamp).label("latest_timestamp"),
+    parameter_labels = reference_data.parameters.by_id
+    latest_settings = [
+        (parameter_labels[setting.id_parameter], setting.value)
+        for setting in await db.execute(
+            select(SettingLatest.id_parameter, SettingLatest.value)
+            .where(SettingLatest.id_greenhouse == greenhouse.id_greenhouse)
         )
-        .filter(Setting.id_greenhouse == greenhouse.id_greenhouse)
-        .group_by(Setting.id_parameter)
-        .subquery()
-    )
-
-    latest_settings = (
-        db.query(Setting, Parameter.label)
-        .join(
-            subquery,
-            (Setting.id_parameter == subquery.c.id_parameter) &
-            (Setting.timestamp == subquery.c.latest_timestamp),
-        )
-        .join(Parameter, Parameter.id_parameter == Setting.id_parameter)
-        .all()
-    )
+        if setting.id_parameter in parameter_labels
+    ]
 
     if not latest_settings:
         raise HTTPException(
@@ -66,10 +37,10 @@ def get_latest_settings(
     response_data = {
         "latest_settings": [
             {
-                "parameter_label": setting[1],
-                "value": setting[0].value,
+                "parameter_label": label,
+                "value": value,
             }
-            for setting in latest_settings
+            for label, value in latest_settings
         ],
     }
 
@@ -82,26 +53,8 @@ def get_latest_settings(
 def post_latest_settings(
     guid: str,
     payload: dict,
-    db: Session = Depends(get_db),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    greenhouse: ResolvedGreenhouse = Depends(get_owned_greenhouse_for_update),
 ):
-    user_id = get_current_user(token, db)
-
-    greenhouse = db.query(Greenhouse).filter(Greenhouse.guid == guid).first()
-    if not greenhouse:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Теплица не найдена",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
-    if greenhouse.id_user != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещён",
-            headers={"Content-Type": "application/json; charset=utf-8"},
-        )
-
     if "new_settings" not in payload:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -123,9 +76,15 @@ def post_latest_settings(
                 headers={"Content-Type": "application/json; charset=utf-8"}
             )
 
-        parameter = db.query(Parameter).filter(Parameter.label == label).first()
+        id_parameter = reference_data.parameters.id(label)
+        if id_parameter is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Параметр не найден",
+                headers={"Content-Type": "application/json; charset=utf-8"}
+            )
 
-        id_value_mapping[str(parameter.id_parameter)] = value
+        id_value_mapping[str(id_parameter)] = value
 
     result = str(id_value_mapping).replace("'", '"').replace(" ", "")
 
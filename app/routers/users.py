@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.schemas.user import UserRegister, UserLogin, UserUpdate, ResendCode, VerifyEmail, ForgotPassword, ResetPassword
 from app.schemas.fcm_token import  FCMTokenPayload
 from app.models.user import User
 from app.models.fcm_token import FCMToken
-from app.dependencies import get_db
-from app.utils.authentication import hash_password, verify_password, create_access_token, generate_hashed_code, verify_hashed_code
-from app.utils.authentication import get_current_user, auth_scheme
+from app.dependencies import get_db, get_async_db
+from app.utils.authentication import hash_password, hash_password_async, verify_password_async, needs_rehash
+from app.utils.authentication import create_access_token, generate_hashed_code, verify_hashed_code
+from app.utils.authentication import get_current_user, get_current_user_async, auth_scheme, revoke_access_token, revoke_user_tokens
 from fastapi.security import HTTPAuthorizationCredentials
 from app.external_services.email import send_email
 
@@ -107,10 +110,12 @@ def resend_verification_code(request: ResendCode, db: Session = Depends(get_db))
     )
 
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = (
+        await db.execute(select(User.id_user, User.email, User.password, User.is_verified).where(User.email == user.email))
+    ).first()
 
-    if not db_user or not verify_password(user.password, db_user.password):
+    if not db_user or not await verify_password_async(user.password, db_user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверные учетные данные",
@@ -124,20 +129,41 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
             headers={"Content-Type": "application/json; charset=utf-8"}
         )
 
-    access_token = create_access_token(data={"sub": db_user.email})
+    # Хеш с прежней стоимостью bcrypt пересчитывается, пока известен пароль
+    if needs_rehash(db_user.password):
+        await db.execute(
+            update(User).where(User.id_user == db_user.id_user).values(password=await hash_password_async(user.password))
+        )
+        await db.commit()
+
+    access_token = create_access_token(data={"sub": db_user.email, "id_user": db_user.id_user})
 
     return JSONResponse(
         content={"access_token": access_token, "token_type": "bearer"},
         headers={"Content-Type": "application/json; charset=utf-8"},
     )
 
-@router.get("/me")
-def get_me(
+@router.post("/logout")
+def logout(
     db: Session = Depends(get_db),
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
-    user_id = get_current_user(token, db)
-    current_user = db.query(User).filter(User.id_user == user_id).first()
+    revoke_access_token(db, token)
+
+    return JSONResponse(
+        content={"message": "Выход выполнен"},
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+
+@router.get("/me")
+async def get_me(
+    db: AsyncSession = Depends(get_async_db),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    user_id = await get_current_user_async(token, db)
+    current_user = (
+        await db.execute(select(User.email, User.first_name, User.last_name).where(User.id_user == user_id))
+    ).first()
 
     return JSONResponse(
         content={
@@ -212,6 +238,8 @@ def reset_password(request: ResetPassword, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.email == str(request.email)).first()
     user.password = hash_password(request.new_password)
     db.commit()
+    # Токены, выданные до смены пароля, перестают действовать
+    revoke_user_tokens(db, user.id_user)
 
     return JSONResponse(
         content={"message": "Пароль успешно изменен"},
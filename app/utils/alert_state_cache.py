@@ -0,0 +1,61 @@
+import threading
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.models.sensor_alert_state import SensorAlertState
+
+
+class AlertStateCache:
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _greenhouse_states(self, db: Session, id_greenhouse: int) -> dict:
+        with self._lock:
+            states = self._states.get(id_greenhouse)
+        if states is not None:
+            return states
+
+        # Состояния теплицы загружаются одним запросом при первом обращении
+        rows = (
+            db.query(SensorAlertState.id_sensor, SensorAlertState.last_alert_sent)
+            .filter(SensorAlertState.id_greenhouse == id_greenhouse)
+            .all()
+        )
+        states = {row.id_sensor: bool(row.last_alert_sent) for row in rows}
+        with self._lock:
+            return self._states.setdefault(id_greenhouse, states)
+
+    def update(self, db: Session, id_greenhouse: int, id_sensor: int, alerting: bool) -> bool:
+        states = self._greenhouse_states(db, id_greenhouse)
+        with self._lock:
+            previous = states.get(id_sensor)
+            if previous == alerting:
+                return False
+            states[id_sensor] = alerting
+
+        alert_timestamp = datetime.utcnow() if alerting else None
+        if previous is None:
+            db.add(SensorAlertState(
+                id_sensor=id_sensor,
+                id_greenhouse=id_greenhouse,
+                last_alert_sent=alerting,
+                alert_timestamp=alert_timestamp,
+            ))
+        else:
+            values = {"last_alert_sent": alerting}
+            if alerting:
+                values["alert_timestamp"] = alert_timestamp
+            db.query(SensorAlertState).filter(
+                SensorAlertState.id_sensor == id_sensor,
+                SensorAlertState.id_greenhouse == id_greenhouse,
+            ).update(values, synchronize_session=False)
+
+        # Уведомление нужно только при переходе в состояние тревоги
+        return alerting
+
+    def invalidate(self, id_greenhouse: int):
+        with self._lock:
+            self._states.pop(id_greenhouse, None)
+
+
+alert_state_cache = AlertStateCache()
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Закрытые месяцы истории выгружаются в Parquet: <ARCHIVE_DIR>/<таблица>/<id_greenhouse>/<ГГГГ-ММ>.parquet
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Таблица -> (столбец датчика/устройства, столбец значения, схема файла)
+ARCHIVE_TABLES = {
+    "sensor_reading": ("id_sensor", "value", pa.schema([
+        ("timestamp", pa.timestamp("us")),
+        ("id_sensor", pa.int32()),
+        ("value", pa.int32()),
+    ])),
+    "device_state": ("id_device", "state", pa.schema([
+        ("timestamp", pa.timestamp("us")),
+        ("id_device", pa.int32()),
+        ("state", pa.bool_()),
+    ])),
+}
+
+
+def archive_path(table: str, id_greenhouse: int, month: datetime) -> str:
+    return os.path.join(ARCHIVE_DIR, table, str(id_greenhouse), f"{month:%Y-%m}.parquet")
+
+
+def is_archived(table: str, id_greenhouse: int, month: datetime) -> bool:
+    return ARCHIVE_ENABLED and os.path.exists(archive_path(table, id_greenhouse, month))
+
+
+def read_archive(table: str, id_greenhouse: int, month: datetime, keys: list, start: datetime, end: datetime) -> pa.Table:
+    key_column = ARCHIVE_TABLES[table][0]
+    # Файл отображается в память; группы строк, не попадающие под фильтр, пропускаются по статистике
+    with pa.memory_map(archive_path(table, id_greenhouse, month)) as source:
+        return pq.read_table(
+            source,
+            filters=[(key_column, "in", keys), ("timestamp", ">=", start), ("timestamp", "<", end)],
+        )
@@ -1,12 +1,22 @@
-import bcrypt
 import jwt
 from fastapi import HTTPException, Depends, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.models.user import User
 from app.dependencies import get_db
+from app.utils.password_hashing import hash_password, verify_password, hash_password_async, verify_password_async, needs_rehash
+from app.utils.token_denylist import token_denylist
+from cachetools import TLRUCache
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 import random
 import hashlib
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 import os
 
@@ -15,14 +25,30 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 auth_scheme = HTTPBearer()
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# Срок действия токена доступа, сек
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", 30 * 24 * 3600))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+# Предельное время жизни записи кэша, сек
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 3600))
+# Токены без exp, выданные до появления срока действия, принимаются до этой даты (UTC, ISO 8601);
+# без значения такие токены не принимаются
+LEGACY_TOKEN_CUTOFF = os.getenv("LEGACY_TOKEN_CUTOFF")
+LEGACY_TOKEN_CUTOFF = datetime.fromisoformat(LEGACY_TOKEN_CUTOFF) if LEGACY_TOKEN_CUTOFF else datetime.min
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+VerifiedToken = namedtuple("VerifiedToken", ["key", "id_user", "email", "jti", "issued_at", "expires_at"])
+
+# Проверенные токены по sha256 от их строки: повторная проверка подписи и поиск
+# пользователя не нужны. Запись живёт не дольше срока действия самого токена
+_token_cache = TLRUCache(
+    maxsize=TOKEN_CACHE_SIZE,
+    ttu=lambda key, value, now: now + min(value.expires_at - time.time(), TOKEN_CACHE_TTL),
+)
+_token_lock = threading.Lock()
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
+    issued_at = time.time()
+    to_encode.update({"iat": issued_at, "exp": int(issued_at + ACCESS_TOKEN_TTL), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -32,24 +58,89 @@ def generate_hashed_code(email: str, action: str):
     hash_code = hashlib.sha256(f"{code}{salt}".encode()).hexdigest()
     return code, hash_code
 
+def _decode_token(token: HTTPAuthorizationCredentials) -> VerifiedToken:
+    key = hashlib.sha256(token.credentials.encode()).digest()
+    with _token_lock:
+        verified = _token_cache.get(key)
+    if verified is None:
+        try:
+            payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Срок действия токена истёк", headers={"WWW-Authenticate": "Bearer"})
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный токен")
+
+        email: str = payload.get("sub")
+        if email is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Недействительные учетные данные")
+        expires_at = payload.get("exp")
+        if expires_at is None:
+            # Старый токен без exp действует до LEGACY_TOKEN_CUTOFF
+            if datetime.utcnow() >= LEGACY_TOKEN_CUTOFF:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Срок действия токена истёк", headers={"WWW-Authenticate": "Bearer"})
+            expires_at = LEGACY_TOKEN_CUTOFF.replace(tzinfo=timezone.utc).timestamp()
+        verified = VerifiedToken(key, payload.get("id_user"), email, payload.get("jti"), payload.get("iat", 0.0), expires_at)
+        # Токены, выданные до появления id_user, кэшируются после поиска пользователя в _resolve_legacy
+        if verified.id_user is not None:
+            with _token_lock:
+                _token_cache[key] = verified
+
+    if verified.id_user is not None and token_denylist.is_revoked(verified.id_user, verified.jti, verified.issued_at):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Токен отозван", headers={"WWW-Authenticate": "Bearer"})
+    return verified
+
+def _resolve_legacy(verified: VerifiedToken, id_user: Optional[int]) -> VerifiedToken:
+    if id_user is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Недействительные учетные данные")
+    verified = verified._replace(id_user=id_user)
+    if token_denylist.is_revoked(verified.id_user, verified.jti, verified.issued_at):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Токен отозван", headers={"WWW-Authenticate": "Bearer"})
+    with _token_lock:
+        _token_cache[verified.key] = verified
+    return verified
+
+def verify_token(token: HTTPAuthorizationCredentials, db: Session) -> VerifiedToken:
+    verified = _decode_token(token)
+    if verified.id_user is None:
+        id_user = db.query(User.id_user).filter(User.email == verified.email).scalar()
+        verified = _resolve_legacy(verified, id_user)
+    return verified
+
 def get_current_user(
     token: HTTPAuthorizationCredentials,
     db: Session = Depends(get_db)
 ) -> int:
-    try:
-        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Срок действия токена истёк", headers={"WWW-Authenticate": "Bearer"})
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный токен")
-
-    email: str = payload.get("sub")
-    if email is None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Недействительные учетные данные")
+    return verify_token(token, db).id_user
+
+async def get_current_user_async(token: HTTPAuthorizationCredentials, db: AsyncSession) -> int:
+    verified = _decode_token(token)
+    if verified.id_user is None:
+        id_user = (await db.execute(select(User.id_user).where(User.email == verified.email))).scalar()
+        verified = _resolve_legacy(verified, id_user)
+    return verified.id_user
+
+def revoke_access_token(db: Session, token: HTTPAuthorizationCredentials):
+    verified = verify_token(token, db)
+    if verified.jti is None:
+        # У старых токенов нет jti, поэтому отзываются все токены пользователя
+        revoke_user_tokens(db, verified.id_user)
+        return
+    token_denylist.revoke(db, datetime.utcfromtimestamp(verified.expires_at), jti=verified.jti)
+    with _token_lock:
+        _token_cache.pop(verified.key, None)
 
-    user = db.query(User).filter(User.email == email).first()
+def revoke_user_tokens(db: Session, id_user: int):
+    # Запись нужна, пока не истекут все выданные до неё токены, включая старые токены без exp
+    expires_at = max(datetime.utcnow() + timedelta(seconds=ACCESS_TOKEN_TTL), LEGACY_TOKEN_CUTOFF)
+    token_denylist.revoke(db, expires_at, id_user=id_user)
 
-    return user.id_user
+def token_cache_stats() -> dict:
+    with _token_lock:
+        return {
+            "entries": len(_token_cache),
+            "max_entries": TOKEN_CACHE_SIZE,
+            "denylist_refreshed": token_denylist.last_refresh.isoformat() if token_denylist.last_refresh else None,
+        }
 
 def verify_hashed_code(email: str, entered_code: str, received_hash: str, action: str):
     salt = f"{email}{SECRET_KEY}{action}"
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def lttb(points: list, threshold: int) -> list:
+    """Largest-Triangle-Three-Buckets: прореживает ряд [(timestamp, value)] до threshold точек."""
+    if threshold < 3 or len(points) <= threshold:
+        return points
+
+    x = np.array([timestamp.timestamp() for timestamp, _ in points])
+    y = np.array([value for _, value in points], dtype=float)
+
+    # Первая и последняя точки сохраняются, остальные делятся на threshold - 2 корзины
+    edges = np.linspace(1, len(points) - 1, threshold - 1).astype(np.intp)
+    selected = [0]
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Выбирается точка, образующая с соседями треугольник наибольшей площади
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected.append(previous)
+    selected.append(len(points) - 1)
+
+    return [points[index] for index in selected]
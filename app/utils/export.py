@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from sqlalchemy import select
+from app.dependencies import SessionLocal
+from app.models.sensor_reading import SensorReading
+from app.jobs.partitions import month_start
+from app.utils.archive import read_archive
+from app.utils.history import history_segments
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько строк читается из серверного курсора за один раз
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+
+EXPORT_COLUMNS = ("timestamp", "sensor_label", "value")
+
+def iter_readings(id_greenhouse: int, sensors: dict, start: datetime, end: datetime):
+    # Ответ отдаётся уже после закрытия сессии запроса, поэтому выгрузка открывает свою
+    db = SessionLocal()
+    try:
+        for segment_start, segment_end, source in history_segments(id_greenhouse, start, end):
+            if source == "archive":
+                archived = read_archive(
+                    SensorReading.__tablename__, id_greenhouse, month_start(segment_start), list(sensors), segment_start, segment_end,
+                )
+                for batch in archived.to_batches(EXPORT_BATCH_SIZE):
+                    yield [
+                        (timestamp, sensors[id_sensor], value)
+                        for timestamp, id_sensor, value in zip(*(batch[column].to_pylist() for column in ("timestamp", "id_sensor", "value")))
+                    ]
+                continue
+
+            statement = (
+                select(SensorReading.timestamp, SensorReading.id_sensor, SensorReading.value)
+                .where(
+                    SensorReading.id_greenhouse == id_greenhouse,
+                    SensorReading.id_sensor.in_(list(sensors)),
+                    SensorReading.timestamp >= segment_start,
+                    SensorReading.timestamp < segment_end,
+                )
+                .order_by(SensorReading.timestamp, SensorReading.id_sensor)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            for partition in db.execute(statement).partitions():
+                yield [(timestamp, sensors[id_sensor], value) for timestamp, id_sensor, value in partition]
+    finally:
+        db.close()
+
+def export_ndjson(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps({"timestamp": timestamp.isoformat(), "sensor_label": label, "value": value}, ensure_ascii=False) + "\n"
+            for timestamp, label, value in batch
+        )
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows((timestamp.isoformat(), label, value) for timestamp, label, value in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+}
@@ -0,0 +1,68 @@
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.dependencies import get_db, get_async_db
+from app.models.greenhouse import Greenhouse
+from app.utils.authentication import get_current_user, get_current_user_async, auth_scheme
+from app.utils.greenhouse_cache import ResolvedGreenhouse, resolve_greenhouse, resolve_greenhouse_async
+
+def _check_owner(greenhouse: ResolvedGreenhouse, user_id: int) -> ResolvedGreenhouse:
+    if not greenhouse:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Теплица не найдена",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    if greenhouse.id_user != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ запрещён",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    return greenhouse
+
+# Зависимости для обработчиков с {guid} в пути: пользователь берётся из кэша проверенных токенов,
+# теплица — из кэша теплиц, так что в обычном случае проверка владельца не обращается к базе.
+# Сессия та же, что и у обработчика: FastAPI создаёт get_db один раз на запрос
+def get_owned_greenhouse(
+    guid: str,
+    db: Session = Depends(get_db),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+) -> ResolvedGreenhouse:
+    user_id = get_current_user(token, db)
+    return _check_owner(resolve_greenhouse(db, guid), user_id)
+
+async def get_owned_greenhouse_async(
+    guid: str,
+    db: AsyncSession = Depends(get_async_db),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+) -> ResolvedGreenhouse:
+    user_id = await get_current_user_async(token, db)
+    return _check_owner(await resolve_greenhouse_async(db, guid), user_id)
+
+# Для команд устройствам и записи настроек владелец проверяется по базе: кэш другого
+# процесса может ещё помнить прежнего владельца после отвязки теплицы
+def get_owned_greenhouse_for_update(
+    guid: str,
+    db: Session = Depends(get_db),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+) -> ResolvedGreenhouse:
+    user_id = get_current_user(token, db)
+    row = db.execute(
+        select(Greenhouse.id_greenhouse, Greenhouse.title)
+        .where(Greenhouse.guid == guid, Greenhouse.id_user == user_id)
+    ).first()
+    if row is None:
+        # Теплицы удаляются только вместе с базой, поэтому для выбора между 404 и 403 хватает кэша
+        if resolve_greenhouse(db, guid) is None:
+            _check_owner(None, user_id)
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ запрещён",
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+    return ResolvedGreenhouse(guid, row.id_greenhouse, user_id, row.title)
@@ -0,0 +1,139 @@
+import os
+import select as selectors
+import threading
+from collections import namedtuple
+from typing import Optional
+from cachetools import LRUCache, TTLCache
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.dependencies import DATABASE_URL
+from app.models.greenhouse import Greenhouse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GREENHOUSE_CACHE_SIZE = int(os.getenv("GREENHOUSE_CACHE_SIZE", 10000))
+GREENHOUSE_CACHE_TTL = float(os.getenv("GREENHOUSE_CACHE_TTL", 300))
+
+ResolvedGreenhouse = namedtuple("ResolvedGreenhouse", ["guid", "id_greenhouse", "id_user", "title"])
+
+# Канал PostgreSQL, по которому процессы сообщают друг другу об изменении владельца или названия
+GREENHOUSE_CHANNEL = "greenhouse_changed"
+
+_cache = TTLCache(maxsize=GREENHOUSE_CACHE_SIZE, ttl=GREENHOUSE_CACHE_TTL)
+# Последние известные записи без срока жизни: приём использует их, пока база недоступна
+_last_known = LRUCache(maxsize=GREENHOUSE_CACHE_SIZE)
+_lock = threading.Lock()
+
+def resolve_greenhouse(db: Session, guid: str, allow_stale: bool = False) -> Optional[ResolvedGreenhouse]:
+    with _lock:
+        cached = _cache.get(guid)
+    if cached is not None:
+        return cached
+
+    try:
+        row = (
+            db.query(Greenhouse.id_greenhouse, Greenhouse.id_user, Greenhouse.title)
+            .filter(Greenhouse.guid == guid)
+            .first()
+        )
+    except OperationalError:
+        with _lock:
+            stale = _last_known.get(guid)
+        if not allow_stale or stale is None:
+            raise
+        db.rollback()
+        return stale
+    if row is None:
+        return None
+
+    resolved = ResolvedGreenhouse(guid, row.id_greenhouse, row.id_user, row.title)
+    with _lock:
+        _cache[guid] = resolved
+        _last_known[guid] = resolved
+    return resolved
+
+async def resolve_greenhouse_async(db: AsyncSession, guid: str) -> Optional[ResolvedGreenhouse]:
+    with _lock:
+        cached = _cache.get(guid)
+    if cached is not None:
+        return cached
+
+    row = (
+        await db.execute(
+            select(Greenhouse.id_greenhouse, Greenhouse.id_user, Greenhouse.title).where(Greenhouse.guid == guid)
+        )
+    ).first()
+    if row is None:
+        return None
+
+    resolved = ResolvedGreenhouse(guid, row.id_greenhouse, row.id_user, row.title)
+    with _lock:
+        _cache[guid] = resolved
+        _last_known[guid] = resolved
+    return resolved
+
+def invalidate_greenhouse(guid: str):
+    with _lock:
+        _cache.pop(guid, None)
+        _last_known.pop(guid, None)
+
+def notify_greenhouse_changed(db: Session, guid: str):
+    # Вызывается до commit: PostgreSQL доставит уведомление только вместе с транзакцией
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_notify(:channel, :guid)"), {"channel": GREENHOUSE_CHANNEL, "guid": guid})
+
+
+class GreenhouseInvalidationListener:
+    """Сбрасывает записи кэша по уведомлениям из других процессов (API-воркеров и приёма MQTT)."""
+
+    def __init__(self, reconnect_delay: float = 5.0):
+        self.reconnect_delay = reconnect_delay
+        self._engine = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        # Отдельное соединение вне пулов: оно занято LISTEN всё время работы процесса
+        self._engine = create_engine(DATABASE_URL, poolclass=NullPool)
+        if self._engine.dialect.name != "postgresql":
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="greenhouse-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Error listening for greenhouse changes: {e}")
+                self._stop.wait(self.reconnect_delay)
+
+    def _listen(self):
+        with self._engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql(f"LISTEN {GREENHOUSE_CHANNEL}")
+            # Пока соединения не было, уведомления могли потеряться
+            with _lock:
+                _cache.clear()
+                _last_known.clear()
+            dbapi_connection = connection.connection.dbapi_connection
+            while not self._stop.is_set():
+                if not selectors.select([dbapi_connection], [], [], 1.0)[0]:
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    invalidate_greenhouse(dbapi_connection.notifies.pop(0).payload)
+
+
+greenhouse_listener = GreenhouseInvalidationListener()
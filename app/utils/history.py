@@ -0,0 +1,158 @@
+import calendar
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy.orm import Session
+from app.models.sensor_reading import SensorReading
+from app.models.sensor_reading_rollup import SensorReadingHourly, SensorReadingDaily
+from app.utils.rollups import ROLLUPS, truncate_bucket
+from app.utils.archive import ARCHIVE_ENABLED, is_archived, read_archive
+from app.jobs.partitions import month_start
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько дней хранятся сырые показания; более старые доступны только в часовых агрегатах.
+# 0 — хранить всё и не запускать очистку: удаление необратимо, поэтому включается явно
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", 0))
+
+def raw_retention_cutoff(now: datetime = None) -> Optional[datetime]:
+    if RETENTION_RAW_DAYS <= 0:
+        return None
+    # Граница выравнивается по часу, чтобы часовой агрегат не пересекался с сырыми строками
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=RETENTION_RAW_DAYS)).replace(minute=0, second=0, microsecond=0)
+    # При архивировании сырые строки удаляются только из закрытых (уже выгруженных) месяцев
+    if ARCHIVE_ENABLED:
+        cutoff = min(cutoff, month_start(now))
+    return cutoff
+
+def history_segments(id_greenhouse: int, start: datetime, end: datetime) -> list:
+    """Делит период на отрезки [(start, end, source)], source: "archive", "rollup" или "raw"."""
+    cutoff = raw_retention_cutoff()
+    segments = []
+    month = month_start(start)
+    while month < end:
+        month_end = month_start(month, 1)
+        bounds = [max(start, month), min(end, month_end)]
+        if cutoff is not None and bounds[0] < cutoff < bounds[1]:
+            bounds.insert(1, cutoff)
+        for segment_start, segment_end in zip(bounds, bounds[1:]):
+            if cutoff is None or segment_start >= cutoff:
+                source = "raw"
+            elif is_archived(SensorReading.__tablename__, id_greenhouse, month):
+                source = "archive"
+            else:
+                source = "rollup"
+            # Соседние отрезки из одного источника объединяются
+            if segments and segments[-1][2] == source and source != "archive":
+                segments[-1] = (segments[-1][0], segment_end, source)
+            else:
+                segments.append((segment_start, segment_end, source))
+        month = month_end
+    return segments
+
+def load_rollup(db: Session, model, id_greenhouse: int, id_sensor: int, start: datetime, end: datetime) -> list:
+    rows = (
+        db.query(model.bucket, model.value_sum, model.value_count)
+        .filter(
+            model.id_sensor == id_sensor,
+            model.id_greenhouse == id_greenhouse,
+            model.bucket >= truncate_bucket(start, ROLLUPS[model]),
+            model.bucket < end,
+        )
+        .order_by(model.bucket)
+    )
+    return [(bucket, round(value_sum / count, 1)) for bucket, value_sum, count in rows]
+
+def load_readings(db: Session, id_greenhouse: int, id_sensor: int, start: datetime, end: datetime) -> list:
+    points = []
+    for segment_start, segment_end, source in history_segments(id_greenhouse, start, end):
+        if source == "archive":
+            archived = read_archive(
+                SensorReading.__tablename__, id_greenhouse, month_start(segment_start), [id_sensor], segment_start, segment_end,
+            )
+            points.extend(zip(archived["timestamp"].to_pylist(), archived["value"].to_pylist()))
+        elif source == "rollup":
+            points.extend(load_rollup(db, SensorReadingHourly, id_greenhouse, id_sensor, segment_start, segment_end))
+        else:
+            raw = (
+                db.query(SensorReading.timestamp, SensorReading.value)
+                .filter(
+                    SensorReading.id_sensor == id_sensor,
+                    SensorReading.id_greenhouse == id_greenhouse,
+                    SensorReading.timestamp >= segment_start,
+                    SensorReading.timestamp < segment_end,
+                )
+                .order_by(SensorReading.timestamp)
+            )
+            points.extend((timestamp, value) for timestamp, value in raw)
+    return points
+
+def load_series(db: Session, id_greenhouse: int, id_sensor: int, start: datetime, end: datetime, points: int) -> list:
+    # Если на одну точку графика приходится час и больше, сырые строки не нужны
+    step = (end - start) / points
+    if step >= timedelta(days=1):
+        return load_rollup(db, SensorReadingDaily, id_greenhouse, id_sensor, start, end)
+    if step >= timedelta(hours=1):
+        return load_rollup(db, SensorReadingHourly, id_greenhouse, id_sensor, start, end)
+    return load_readings(db, id_greenhouse, id_sensor, start, end)
+
+def hourly_history(db: Session, id_greenhouse: int, id_sensors: list, year: int, month: int, day: int) -> dict:
+    start = datetime(year, month, day)
+    template = {f"{year}-{month:02d}-{day:02d} {hour:02d}:00-{hour + 1:02d}:00": 0 for hour in range(24)}
+    history = {id_sensor: dict(template) for id_sensor in id_sensors}
+
+    # Один запрос по всем датчикам, сгруппированный по (id_sensor, bucket)
+    hourly_data = (
+        db.query(
+            SensorReadingHourly.id_sensor,
+            SensorReadingHourly.bucket,
+            SensorReadingHourly.value_sum,
+            SensorReadingHourly.value_count,
+        )
+        .filter(
+            SensorReadingHourly.id_sensor.in_(id_sensors),
+            SensorReadingHourly.id_greenhouse == id_greenhouse,
+            SensorReadingHourly.bucket >= start,
+            SensorReadingHourly.bucket < start + timedelta(days=1),
+        )
+        .order_by(SensorReadingHourly.id_sensor, SensorReadingHourly.bucket)
+    )
+    for id_sensor, hour, value_sum, count in hourly_data:
+        hour_str = f"{hour.strftime('%Y-%m-%d %H:00')}-{(hour + timedelta(hours=1)).strftime('%H:00')}"
+        history[id_sensor][hour_str] = round(value_sum / count, 1) if count > 5 else 0
+
+    return {id_sensor: _non_empty(result) for id_sensor, result in history.items()}
+
+def daily_history(db: Session, id_greenhouse: int, id_sensors: list, year: int, month: int) -> dict:
+    days = calendar.monthrange(year, month)[1]
+    start = datetime(year, month, 1)
+    template = {f"{year}-{month:02d}-{day:02d}": 0 for day in range(1, days + 1)}
+    history = {id_sensor: dict(template) for id_sensor in id_sensors}
+
+    daily_data = (
+        db.query(
+            SensorReadingDaily.id_sensor,
+            SensorReadingDaily.bucket,
+            SensorReadingDaily.value_sum,
+            SensorReadingDaily.value_count,
+        )
+        .filter(
+            SensorReadingDaily.id_sensor.in_(id_sensors),
+            SensorReadingDaily.id_greenhouse == id_greenhouse,
+            SensorReadingDaily.bucket >= start,
+            SensorReadingDaily.bucket < start + timedelta(days=days),
+        )
+        .order_by(SensorReadingDaily.id_sensor, SensorReadingDaily.bucket)
+    )
+    for id_sensor, day, value_sum, count in daily_data:
+        history[id_sensor][day.strftime("%Y-%m-%d")] = round(value_sum / count, 1) if count >= 12 else 0
+
+    return {id_sensor: _non_empty(result) for id_sensor, result in history.items()}
+
+def _non_empty(result: dict) -> dict:
+    # Ряд без единого достаточного измерения отдаётся пустым
+    if all(value == 0 for value in result.values()):
+        return {}
+    return result
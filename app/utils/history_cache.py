@@ -0,0 +1,93 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from cachetools import TLRUCache
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from app.jobs.partitions import month_start
+from app.utils.history import hourly_history, daily_history
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Время жизни агрегатов за ещё не закончившийся день или месяц, сек
+HISTORY_CACHE_OPEN_TTL = float(os.getenv("HISTORY_CACHE_OPEN_TTL", 60))
+# Сколько после окончания периода ещё ждать опоздавших показаний (например, из журнала приёма), сек
+HISTORY_CACHE_CLOSE_GRACE = float(os.getenv("HISTORY_CACHE_CLOSE_GRACE", 3600))
+
+CachedHistory = namedtuple("CachedHistory", ["data", "size", "ttl"])
+
+# Закрытые периоды не меняются и хранятся бессрочно, пока их не вытеснят по LRU;
+# размер записи оценивается по длине её JSON
+_cache = TLRUCache(
+    maxsize=HISTORY_CACHE_MAX_BYTES,
+    ttu=lambda key, value, now: now + value.ttl,
+    getsizeof=lambda value: value.size,
+)
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+def cached_history(db: Session, id_greenhouse: int, id_sensors: list, year: int, month: int, day: int = None) -> dict:
+    global _hits, _misses
+    keys = {id_sensor: (id_greenhouse, id_sensor, year, month, day) for id_sensor in id_sensors}
+    history = {}
+    with _lock:
+        for id_sensor, key in keys.items():
+            cached = _cache.get(key)
+            if cached is not None:
+                history[id_sensor] = cached.data
+        _hits += len(history)
+        _misses += len(keys) - len(history)
+
+    missing = [id_sensor for id_sensor in id_sensors if id_sensor not in history]
+    if not missing:
+        return history
+
+    if day is not None:
+        computed = hourly_history(db, id_greenhouse, missing, year, month, day)
+        period_end = datetime(year, month, day) + timedelta(days=1)
+    else:
+        computed = daily_history(db, id_greenhouse, missing, year, month)
+        period_end = month_start(datetime(year, month, 1), 1)
+    closed = period_end + timedelta(seconds=HISTORY_CACHE_CLOSE_GRACE) <= datetime.utcnow()
+    ttl = math.inf if closed else HISTORY_CACHE_OPEN_TTL
+
+    with _lock:
+        for id_sensor, data in computed.items():
+            size = len(json.dumps(data))
+            if size <= HISTORY_CACHE_MAX_BYTES:
+                _cache[keys[id_sensor]] = CachedHistory(data, size, ttl)
+    history.update(computed)
+    return history
+
+def etag_response(request: Request, content: dict) -> Response:
+    response = JSONResponse(
+        content=content,
+        headers={"Content-Type": "application/json; charset=utf-8"},
+    )
+    etag = f'"{hashlib.sha256(response.body).hexdigest()[:32]}"'
+    # Клиент с актуальной копией получает 304 без тела
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return response
+
+def history_cache_stats() -> dict:
+    with _lock:
+        requests = _hits + _misses
+        return {
+            "entries": len(_cache),
+            "bytes": _cache.currsize,
+            "max_bytes": HISTORY_CACHE_MAX_BYTES,
+            "hits": _hits,
+            "misses": _misses,
+            "hit_ratio": round(_hits / requests, 3) if requests else 0.0,
+        }
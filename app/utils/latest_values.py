@@ -0,0 +1,58 @@
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.models.sensor_reading import SensorReading
+from app.models.device_state import DeviceState
+from app.models.setting import Setting
+from app.models.sensor_latest import SensorLatest
+from app.models.device_state_latest import DeviceStateLatest
+from app.models.setting_latest import SettingLatest
+
+# Таблица истории -> (модель истории, таблица последних значений, ключевой столбец, столбец значения)
+LATEST_TABLES = {
+    SensorReading.__tablename__: (SensorReading, SensorLatest, "id_sensor", "value"),
+    DeviceState.__tablename__: (DeviceState, DeviceStateLatest, "id_device", "state"),
+    Setting.__tablename__: (Setting, SettingLatest, "id_parameter", "value"),
+}
+
+def upsert_latest(db: Session, table: str, rows: list):
+    if table not in LATEST_TABLES or not rows:
+        return
+    _, latest_model, key, value = LATEST_TABLES[table]
+
+    # В одной команде ON CONFLICT ключ может встречаться только один раз,
+    # а сортировка ключей исключает взаимные блокировки параллельных писателей
+    latest_rows = {}
+    for row in rows:
+        row_key = (row["id_greenhouse"], row[key])
+        current = latest_rows.get(row_key)
+        if current is None or row["timestamp"] >= current["timestamp"]:
+            latest_rows[row_key] = row
+
+    stmt = insert(latest_model).values([
+        {"id_greenhouse": row["id_greenhouse"], key: row[key], value: row[value], "timestamp": row["timestamp"]}
+        for _, row in sorted(latest_rows.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["id_greenhouse", key],
+        set_={value: stmt.excluded[value], "timestamp": stmt.excluded.timestamp},
+        # Запоздавшие строки (например, из журнала) не затирают более свежие значения
+        where=latest_model.__table__.c.timestamp <= stmt.excluded.timestamp,
+    )
+    db.execute(stmt)
+
+def backfill_latest_values(db: Session):
+    for history_model, latest_model, key, value in LATEST_TABLES.values():
+        if db.query(latest_model).first():
+            continue
+
+        columns = ["id_greenhouse", key, value, "timestamp"]
+        latest_history = (
+            select(*(getattr(history_model, column) for column in columns))
+            .where(history_model.timestamp.is_not(None))
+            .distinct(history_model.id_greenhouse, getattr(history_model, key))
+            .order_by(history_model.id_greenhouse, getattr(history_model, key), history_model.timestamp.desc())
+        )
+        db.execute(insert(latest_model).from_select(columns, latest_history).on_conflict_do_nothing())
+        db.commit()
+        print(f"Таблица '{latest_model.__tablename__}' заполнена из истории.")
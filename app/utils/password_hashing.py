@@ -0,0 +1,109 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Стоимость bcrypt (log2 числа раундов); хеши с другой стоимостью пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Процессы для bcrypt; 0 — считать в потоке обработчика
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Сколько операций может выполняться и ждать в очереди; сверх этого сразу отвечаем 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", max(PASSWORD_HASH_WORKERS, 1) * 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_rejected = 0
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения сервера
+            _executor = ProcessPoolExecutor(PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _acquire_slot():
+    global _rejected
+    if not _slots.acquire(blocking=False):
+        _rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите попытку позже",
+            headers={"Content-Type": "application/json; charset=utf-8", "Retry-After": "1"},
+        )
+
+
+def _run(function, *args):
+    _acquire_slot()
+    try:
+        if not PASSWORD_HASH_WORKERS:
+            return function(*args)
+        return _get_executor().submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+async def _run_async(function, *args):
+    _acquire_slot()
+    try:
+        if not PASSWORD_HASH_WORKERS:
+            return await asyncio.to_thread(function, *args)
+        return await asyncio.wrap_future(_get_executor().submit(function, *args))
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _run(_hash, password, BCRYPT_ROUNDS)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _run(_verify, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_async(_hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_async(_verify, plain_password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # Формат хеша: $2b$<стоимость>$<соль и хеш>
+    return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+
+
+def shutdown_password_pool():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def password_pool_stats() -> dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": PASSWORD_HASH_MAX_PENDING - _slots._value,
+        "rejected": _rejected,
+    }
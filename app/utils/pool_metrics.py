@@ -0,0 +1,72 @@
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, wait: float, overflowed: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflowed:
+                self.overflow_events += 1
+
+    def record_timeout(self, wait: float):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            stats = {
+                "checkouts": self.checkouts,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / waits * 1000, 3) if waits else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+        if self.pool is not None:
+            stats.update({
+                "size": self.pool.size(),
+                "in_use": self.pool.checkedout(),
+                "idle": self.pool.checkedin(),
+                "overflow": max(self.pool.overflow(), 0),
+            })
+        return stats
+
+
+def instrumented_pool(base, metrics: PoolMetrics):
+    """Подкласс пула, замеряющий ожидание свободного соединения и выход за pool_size."""
+
+    class InstrumentedPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Пул пересоздаётся при dispose(), метрики переходят к новому экземпляру
+            metrics.pool = self
+
+        def _do_get(self):
+            overflow = self.overflow()
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.record_timeout(time.perf_counter() - started)
+                raise
+            metrics.record_checkout(time.perf_counter() - started, self.overflow() > max(overflow, 0))
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
@@ -0,0 +1,83 @@
+import threading
+from types import MappingProxyType
+from typing import Optional
+from app.dependencies import SessionLocal
+from app.models.sensor import Sensor
+from app.models.device import Device
+from app.models.parameter import Parameter
+
+
+class LabelMap:
+    """Неизменяемое соответствие id ↔ label одного справочника."""
+
+    __slots__ = ("by_id", "by_label")
+
+    def __init__(self, rows):
+        by_id = {id_: label for id_, label in rows}
+        self.by_id = MappingProxyType(by_id)
+        self.by_label = MappingProxyType({label: id_ for id_, label in by_id.items()})
+
+    def id(self, label: str) -> Optional[int]:
+        return self.by_label.get(label)
+
+    def label(self, id_: int) -> Optional[str]:
+        return self.by_id.get(id_)
+
+
+class ReferenceData:
+    """Справочники датчиков, устройств и параметров в памяти процесса.
+
+    Таблицы заполняются при первом запуске (app.models.initialize_database) и почти не меняются,
+    поэтому метки берутся из словарей вместо запросов и join. Снимок заменяется целиком при reload();
+    после изменения справочников в базе нужно вызвать reference_data.reload() в каждом процессе.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def _load(self) -> tuple:
+        with self.session_factory() as db:
+            return (
+                LabelMap(db.query(Sensor.id_sensor, Sensor.label)),
+                LabelMap(db.query(Device.id_device, Device.label)),
+                LabelMap(db.query(Parameter.id_parameter, Parameter.label)),
+            )
+
+    def _get(self) -> tuple:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        snapshot = self._load()
+        with self._lock:
+            self._snapshot = snapshot
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def on_reload(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    @property
+    def sensors(self) -> LabelMap:
+        return self._get()[0]
+
+    @property
+    def devices(self) -> LabelMap:
+        return self._get()[1]
+
+    @property
+    def parameters(self) -> LabelMap:
+        return self._get()[2]
+
+
+reference_data = ReferenceData()
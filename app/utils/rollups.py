@@ -0,0 +1,91 @@
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from app.models.sensor_reading import SensorReading
+from app.models.sensor_reading_rollup import SensorReadingHourly, SensorReadingDaily
+
+# Ключ рекомендательной блокировки: агрегаты заполняет из истории только один процесс
+ROLLUP_BACKFILL_LOCK_KEY = 7412002
+
+# Модель агрегата -> единица date_trunc
+ROLLUPS = {
+    SensorReadingHourly: "hour",
+    SensorReadingDaily: "day",
+}
+
+def truncate_bucket(timestamp, unit: str):
+    if unit == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def upsert_rollups(db: Session, table: str, rows: list):
+    if table != SensorReading.__tablename__ or not rows:
+        return
+
+    for model, unit in ROLLUPS.items():
+        buckets = {}
+        for row in rows:
+            key = (row["id_greenhouse"], row["id_sensor"], truncate_bucket(row["timestamp"], unit))
+            value = row["value"]
+            current = buckets.get(key)
+            if current is None:
+                buckets[key] = [value, 1, value, value]
+            else:
+                current[0] += value
+                current[1] += 1
+                current[2] = min(current[2], value)
+                current[3] = max(current[3], value)
+
+        # Ключи сортируются, чтобы параллельные писатели блокировали строки в одном порядке
+        stmt = insert(model).values([
+            {
+                "id_greenhouse": id_greenhouse,
+                "id_sensor": id_sensor,
+                "bucket": bucket,
+                "value_sum": value_sum,
+                "value_count": value_count,
+                "value_min": value_min,
+                "value_max": value_max,
+            }
+            for (id_greenhouse, id_sensor, bucket), (value_sum, value_count, value_min, value_max) in sorted(buckets.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id_greenhouse", "id_sensor", "bucket"],
+            set_={
+                "value_sum": model.value_sum + stmt.excluded.value_sum,
+                "value_count": model.value_count + stmt.excluded.value_count,
+                "value_min": func.least(model.value_min, stmt.excluded.value_min),
+                "value_max": func.greatest(model.value_max, stmt.excluded.value_max),
+            },
+        )
+        db.execute(stmt)
+
+def backfill_rollups(db: Session):
+    for model, unit in ROLLUPS.items():
+        # Блокировка до конца транзакции: второй процесс дождётся заполнения и увидит непустую таблицу
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ROLLUP_BACKFILL_LOCK_KEY})
+        if db.query(model).first():
+            db.commit()
+            continue
+
+        bucket = func.date_trunc(unit, SensorReading.timestamp)
+        aggregated = (
+            select(
+                SensorReading.id_greenhouse,
+                SensorReading.id_sensor,
+                bucket,
+                func.sum(SensorReading.value),
+                func.count(SensorReading.value),
+                func.min(SensorReading.value),
+                func.max(SensorReading.value),
+            )
+            .where(SensorReading.timestamp.is_not(None))
+            .group_by(SensorReading.id_greenhouse, SensorReading.id_sensor, bucket)
+        )
+        db.execute(insert(model).from_select(
+            ["id_greenhouse", "id_sensor", "bucket", "value_sum", "value_count", "value_min", "value_max"],
+            aggregated,
+        ).on_conflict_do_nothing())
+        db.commit()
+        print(f"Таблица '{model.__tablename__}' заполнена из истории.")
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.jobs.partitions import month_start
+from app.models.sensor_reading import SensorReading
+from app.models.sensor_reading_rollup import SensorReadingHourly
+from app.utils.archive import read_archive
+from app.utils.history import history_segments
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько строк обрабатывается за один проход; определяет расход памяти независимо от длины периода
+STATS_CHUNK_SIZE = int(os.getenv("STATS_CHUNK_SIZE", 50000))
+# Интервал между показаниями больше этого значения считается разрывом связи, сек
+STATS_MAX_GAP = float(os.getenv("STATS_MAX_GAP", 600))
+
+STATS_PERCENTILES = (5, 25, 50, 75, 95)
+HOUR = np.timedelta64(3600, "s")
+
+
+class RangeStatistics:
+    def __init__(self, threshold: float = None):
+        self.threshold = threshold
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.time_above = np.timedelta64(0, "us")
+        # Распределение значений хранится как (значение, вес): показания целочисленные,
+        # поэтому его размер ограничен числом различных значений, а не числом строк
+        self._values = np.empty(0)
+        self._weights = np.empty(0, dtype=np.int64)
+        self._previous = None
+
+    def _merge(self, values, weights):
+        values, inverse = np.unique(np.concatenate([self._values, values]), return_inverse=True)
+        self._weights = np.bincount(inverse, weights=np.concatenate([self._weights, weights])).astype(np.int64)
+        self._values = values
+
+    def add_readings(self, timestamps, values):
+        if not len(values):
+            return
+        values = values.astype(float)
+        self.count += len(values)
+        self.total += values.sum()
+        self.squares += np.square(values).sum()
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        unique, counts = np.unique(values, return_counts=True)
+        self._merge(unique, counts)
+
+        if self.threshold is None:
+            return
+        # Показание действует до следующего; последнее показание пачки переносится в следующую
+        if self._previous is not None:
+            timestamps = np.concatenate([[self._previous[0]], timestamps])
+            values = np.concatenate([[self._previous[1]], values])
+        durations = np.minimum(np.diff(timestamps), np.timedelta64(int(STATS_MAX_GAP * 1e6), "us"))
+        self.time_above += durations[values[:-1] > self.threshold].sum()
+        self._previous = (timestamps[-1], values[-1])
+
+    def add_hourly(self, sums, counts, minimums, maximums):
+        # Для часов без сырых данных средние часовых агрегатов учитываются с весом числа измерений
+        if not len(counts):
+            return
+        means = sums / counts
+        self.count += int(counts.sum())
+        self.total += sums.sum()
+        self.squares += (counts * np.square(means)).sum()
+        self.minimum = min(self.minimum, minimums.min())
+        self.maximum = max(self.maximum, maximums.max())
+        self._merge(np.round(means, 1), counts)
+        if self.threshold is not None:
+            self.time_above += HOUR * int((means > self.threshold).sum())
+        self._previous = None
+
+    def result(self) -> dict:
+        if not self.count:
+            return {}
+        mean = self.total / self.count
+        cumulative = np.cumsum(self._weights)
+        percentiles = {
+            f"p{q}": float(self._values[np.searchsorted(cumulative, q / 100 * self.count)])
+            for q in STATS_PERCENTILES
+        }
+        return {
+            "count": self.count,
+            "mean": round(mean, 2),
+            "min": float(self.minimum),
+            "max": float(self.maximum),
+            "stddev": round(float(np.sqrt(max(self.squares / self.count - mean ** 2, 0))), 2),
+            "percentiles": percentiles,
+            "threshold": self.threshold,
+            "time_above_threshold": int(self.time_above / np.timedelta64(1, "s")) if self.threshold is not None else None,
+        }
+
+
+def sensor_statistics(db: Session, id_greenhouse: int, id_sensor: int, start: datetime, end: datetime,
+                      threshold: float = None) -> dict:
+    statistics = RangeStatistics(threshold)
+    for segment_start, segment_end, source in history_segments(id_greenhouse, start, end):
+        if source == "archive":
+            archived = read_archive(
+                SensorReading.__tablename__, id_greenhouse, month_start(segment_start), [id_sensor], segment_start, segment_end,
+            )
+            for batch in archived.to_batches(STATS_CHUNK_SIZE):
+                statistics.add_readings(
+                    batch["timestamp"].to_numpy(zero_copy_only=False),
+                    batch["value"].to_numpy(zero_copy_only=False),
+                )
+            continue
+
+        if source == "rollup":
+            statement = (
+                select(
+                    SensorReadingHourly.value_sum,
+                    SensorReadingHourly.value_count,
+                    SensorReadingHourly.value_min,
+                    SensorReadingHourly.value_max,
+                )
+                .where(
+                    SensorReadingHourly.id_sensor == id_sensor,
+                    SensorReadingHourly.id_greenhouse == id_greenhouse,
+                    SensorReadingHourly.bucket >= segment_start,
+                    SensorReadingHourly.bucket < segment_end,
+                )
+                .execution_options(yield_per=STATS_CHUNK_SIZE)
+            )
+            for partition in db.execute(statement).partitions():
+                sums, counts, minimums, maximums = (np.array(column, dtype=float) for column in zip(*partition))
+                statistics.add_hourly(sums, counts, minimums, maximums)
+            continue
+
+        statement = (
+            select(SensorReading.timestamp, SensorReading.value)
+            .where(
+                SensorReading.id_sensor == id_sensor,
+                SensorReading.id_greenhouse == id_greenhouse,
+                SensorReading.timestamp >= segment_start,
+                SensorReading.timestamp < segment_end,
+            )
+            .order_by(SensorReading.timestamp)
+            .execution_options(yield_per=STATS_CHUNK_SIZE)
+        )
+        for partition in db.execute(statement).partitions():
+            timestamps, values = zip(*partition)
+            statistics.add_readings(np.array(timestamps, dtype="datetime64[us]"), np.array(values, dtype=float))
+
+    return statistics.result()
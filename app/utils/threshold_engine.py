@@ -0,0 +1,164 @@
+import threading
+from typing import Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from app.models.setting_latest import SettingLatest
+from app.utils.reference_data import reference_data
+
+# Датчик -> (параметр нижней границы, параметр верхней границы, значение верхней границы по умолчанию)
+THRESHOLD_RULES = {
+    "airTemp": (None, "airTempThreshold", 60),
+    "airHum": (None, "airHumThreshold", 80),
+    "soilMoist1": (None, "soilMoistThreshold1", 85),
+    "soilMoist2": (None, "soilMoistThreshold2", 85),
+    "waterTemp": ("waterTempThreshold1", "waterTempThreshold2", None),
+    "waterLevel": ("waterLevelThreshold", None, None),
+    "light": ("lightThreshold", None, None),
+}
+
+ALERT_MESSAGES = {
+    "airTemp": (None, "Температура воздуха превышает {limit}°C ({value}°C)"),
+    "airHum": (None, "Влажность воздуха превышает {limit}% ({value}%)"),
+    "soilMoist1": (None, "Влажность почвы 1 превышает {limit}% ({value}%)"),
+    "soilMoist2": (None, "Влажность почвы 2 превышает {limit}% ({value}%)"),
+    "waterTemp": ("Температура воды ниже {limit}°C ({value}°C)", "Температура воды превышает {limit}°C ({value}°C)"),
+    "waterLevel": ("Уровень воды ниже {limit} ({value})", None),
+    "light": ("Освещенность ниже {limit} ({value})", None),
+}
+
+
+def upper_threshold(db: Session, id_greenhouse: int, sensor_label: str) -> Optional[float]:
+    """Текущая верхняя граница датчика из setting_latest, без состояния движка процесса."""
+    _, upper_label, upper_default = THRESHOLD_RULES.get(sensor_label, (None, None, None))
+    id_parameter = reference_data.parameters.id(upper_label) if upper_label else None
+    if id_parameter is not None:
+        value = db.query(SettingLatest.value).filter(
+            SettingLatest.id_greenhouse == id_greenhouse,
+            SettingLatest.id_parameter == id_parameter,
+        ).scalar()
+        if value is not None:
+            return float(value)
+    return None if upper_default is None else float(upper_default)
+
+
+class ThresholdEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        # Правила зависят от id справочников, поэтому пересобираются после их перезагрузки
+        reference_data.on_reload(self.reset)
+
+    def reset(self):
+        with self._lock:
+            self._rules_loaded = False
+            self._lower_sources = {}
+            self._upper_sources = {}
+            self._rows = {}
+            self._lower = np.empty((0, 0))
+            self._upper = np.empty((0, 0))
+
+    def _load_rules(self):
+        sensor_ids = reference_data.sensors.by_label
+        parameter_ids = reference_data.parameters.by_label
+
+        self._rules_loaded = True
+        slots = max(sensor_ids.values(), default=0) + 1
+        self._default_lower = np.full(slots, np.nan)
+        self._default_upper = np.full(slots, np.nan)
+
+        for sensor_label, (lower_label, upper_label, upper_default) in THRESHOLD_RULES.items():
+            id_sensor = sensor_ids.get(sensor_label)
+            if id_sensor is None:
+                continue
+            if upper_default is not None:
+                self._default_upper[id_sensor] = upper_default
+            if lower_label in parameter_ids:
+                self._lower_sources[parameter_ids[lower_label]] = id_sensor
+            if upper_label in parameter_ids:
+                self._upper_sources[parameter_ids[upper_label]] = id_sensor
+
+        self._lower = np.empty((0, slots))
+        self._upper = np.empty((0, slots))
+
+    def _apply_settings(self, row: int, settings: dict):
+        for id_parameter, value in settings.items():
+            if id_parameter in self._lower_sources:
+                self._lower[row, self._lower_sources[id_parameter]] = value
+            if id_parameter in self._upper_sources:
+                self._upper[row, self._upper_sources[id_parameter]] = value
+
+    def _greenhouse_row(self, db: Session, id_greenhouse: int) -> int:
+        with self._lock:
+            if not self._rules_loaded:
+                self._load_rules()
+            row = self._rows.get(id_greenhouse)
+        if row is not None:
+            return row
+
+        # Последние значения настроек теплицы загружаются один раз
+        settings = dict(
+            db.query(SettingLatest.id_parameter, SettingLatest.value).filter(SettingLatest.id_greenhouse == id_greenhouse)
+        )
+
+        with self._lock:
+            # Справочники могли перезагрузиться, пока читались настройки
+            if not self._rules_loaded:
+                self._load_rules()
+            row = self._rows.get(id_greenhouse)
+            if row is None:
+                row = len(self._rows)
+                if row == self._lower.shape[0]:
+                    capacity = max(16, row * 2)
+                    self._lower = np.resize(self._lower, (capacity, self._lower.shape[1]))
+                    self._upper = np.resize(self._upper, (capacity, self._upper.shape[1]))
+                self._lower[row] = self._default_lower
+                self._upper[row] = self._default_upper
+                self._apply_settings(row, settings)
+                self._rows[id_greenhouse] = row
+        return row
+
+    def update_settings(self, db: Session, id_greenhouse: int, settings: dict):
+        row = self._greenhouse_row(db, id_greenhouse)
+        with self._lock:
+            self._apply_settings(row, settings)
+
+    def evaluate_batch(self, db: Session, id_greenhouses, id_sensors, values):
+        greenhouses, inverse = np.unique(np.asarray(id_greenhouses, dtype=np.int64), return_inverse=True)
+        rows = np.array(
+            [self._greenhouse_row(db, int(id_greenhouse)) for id_greenhouse in greenhouses],
+            dtype=np.intp,
+        )[inverse]
+        id_sensors = np.asarray(id_sensors, dtype=np.intp)
+        values = np.asarray(values, dtype=float)
+
+        with self._lock:
+            known = (id_sensors >= 0) & (id_sensors < self._lower.shape[1])
+            slots = np.where(known, id_sensors, 0)
+            lower = np.where(known, self._lower[rows, slots], np.nan)
+            upper = np.where(known, self._upper[rows, slots], np.nan)
+
+        # Сравнение с NaN всегда ложно, поэтому неуказанные границы не срабатывают
+        below = values < lower
+        above = values > upper
+        return below, above, lower, upper
+
+    def evaluate(self, db: Session, id_greenhouse: int, data: dict) -> dict:
+        id_sensors = [int(key) for key in data]
+        values = list(data.values())
+        below, above, lower, upper = self.evaluate_batch(db, [id_greenhouse] * len(id_sensors), id_sensors, values)
+
+        alerts = {}
+        for i, id_sensor in enumerate(id_sensors):
+            alerts[id_sensor] = None
+            label = reference_data.sensors.label(id_sensor)
+            if label not in ALERT_MESSAGES:
+                continue
+            low_message, high_message = ALERT_MESSAGES[label]
+            if below[i] and low_message:
+                alerts[id_sensor] = low_message.format(limit=f"{lower[i]:g}", value=values[i])
+            elif above[i] and high_message:
+                alerts[id_sensor] = high_message.format(limit=f"{upper[i]:g}", value=values[i])
+        return alerts
+
+
+threshold_engine = ThresholdEngine()
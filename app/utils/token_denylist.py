@@ -0,0 +1,99 @@
+import os
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from app.dependencies import SessionLocal
+from app.models.revoked_token import RevokedToken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Как часто процесс подтягивает отзывы, сделанные другими процессами, сек
+TOKEN_DENYLIST_REFRESH = float(os.getenv("TOKEN_DENYLIST_REFRESH", 30))
+
+
+def _timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenDenylist:
+    """Отозванные токены в памяти процесса: проверка токена не обращается к базе.
+
+    Отзыв сразу действует в процессе, который его выполнил, и сохраняется в таблицу
+    revoked_token; остальные процессы перечитывают её раз в TOKEN_DENYLIST_REFRESH секунд.
+    """
+
+    def __init__(self, interval: float = TOKEN_DENYLIST_REFRESH):
+        self.interval = interval
+        self.last_refresh = None
+        self._tokens = set()
+        self._users = {}
+        self._recent = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_revoked(self, id_user: int, jti: str, issued_at: float) -> bool:
+        with self._lock:
+            if jti is not None and jti in self._tokens:
+                return True
+            revoked_at = self._users.get(id_user)
+        return revoked_at is not None and issued_at < revoked_at
+
+    def _add(self, jti: str, id_user: int, revoked_at: datetime):
+        if jti is not None:
+            self._tokens.add(jti)
+        elif id_user is not None:
+            self._users[id_user] = max(self._users.get(id_user, 0.0), _timestamp(revoked_at))
+
+    def revoke(self, db: Session, expires_at: datetime, jti: str = None, id_user: int = None):
+        revoked = RevokedToken(jti=jti, id_user=id_user, revoked_at=datetime.utcnow(), expires_at=expires_at)
+        db.add(revoked)
+        db.commit()
+        with self._lock:
+            self._add(jti, id_user, revoked.revoked_at)
+            self._recent.append((jti, id_user, revoked.revoked_at))
+
+    def refresh(self):
+        now = datetime.utcnow()
+        with self._lock:
+            self._recent = []
+        with SessionLocal() as db:
+            db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            db.commit()
+            rows = db.execute(select(RevokedToken.jti, RevokedToken.id_user, RevokedToken.revoked_at)).all()
+
+        with self._lock:
+            self._tokens, self._users = set(), {}
+            # Отзывы, сделанные этим процессом во время чтения, могли не попасть в выборку
+            for jti, id_user, revoked_at in [*rows, *self._recent]:
+                self._add(jti, id_user, revoked_at)
+        self.last_refresh = now
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # Первое чтение синхронно, чтобы отозванные токены не принимались сразу после запуска
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing token denylist: {e}")
+        self._thread = threading.Thread(target=self._run, name="token-denylist", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing token denylist: {e}")
+
+
+token_denylist = TokenDenylist()
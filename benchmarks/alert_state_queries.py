@@ -0,0 +1,78 @@
+# Сравнение количества SQL-запросов на одно сообщение d/cur:
+# прежняя схема (SELECT + UPDATE SensorAlertState на каждый датчик)
+# и кэш состояний уведомлений.
+#
+# Запуск: python -m benchmarks.alert_state_queries
+import os
+import random
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mktemp(suffix='.db')}"
+
+from sqlalchemy import event, text
+from app.dependencies import Base, SessionLocal, engine
+
+# app.models заполняет справочники при импорте, поэтому их таблицы создаются заранее
+with engine.begin() as connection:
+    for table in ("sensor", "device", "parameter"):
+        connection.execute(text(
+            f"CREATE TABLE {table} (id_{table} INTEGER PRIMARY KEY, name VARCHAR NOT NULL, label VARCHAR NOT NULL)"
+        ))
+
+from app.models.user import User
+from app.models.fcm_token import FCMToken
+from app.models.greenhouse import Greenhouse
+from app.models.sensor_alert_state import SensorAlertState
+from app.utils.alert_state_cache import AlertStateCache
+
+GREENHOUSES = 20
+MESSAGES = 500
+SENSORS = range(1, 8)
+
+query_count = 0
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    global query_count
+    query_count += 1
+
+def generate_messages():
+    rng = random.Random(42)
+    for _ in range(MESSAGES):
+        id_greenhouse = rng.randint(1, GREENHOUSES)
+        # Значения редко выходят за порог, как и в реальных данных
+        yield id_greenhouse, {id_sensor: rng.choice([20] * 19 + [99]) for id_sensor in SENSORS}
+
+def legacy(db, id_greenhouse, data):
+    for id_sensor, value in data.items():
+        alert_state = db.query(SensorAlertState).filter(
+            SensorAlertState.id_sensor == id_sensor,
+            SensorAlertState.id_greenhouse == id_greenhouse
+        ).first()
+        if not alert_state:
+            alert_state = SensorAlertState(id_sensor=id_sensor, id_greenhouse=id_greenhouse, last_alert_sent=False)
+            db.add(alert_state)
+        alert_state.last_alert_sent = value > 60
+        db.add(alert_state)
+    db.commit()
+
+def cached(cache, db, id_greenhouse, data):
+    for id_sensor, value in data.items():
+        cache.update(db, id_greenhouse, id_sensor, value > 60)
+    db.commit()
+
+def run(name, handler):
+    global query_count
+    Base.metadata.drop_all(bind=engine, tables=[SensorAlertState.__table__])
+    Base.metadata.create_all(bind=engine, tables=[SensorAlertState.__table__])
+    query_count = 0
+    with SessionLocal() as db:
+        for id_greenhouse, data in generate_messages():
+            handler(db, id_greenhouse, data)
+    print(f"{name}: {query_count / MESSAGES:.2f} запросов на сообщение")
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine, tables=[User.__table__, Greenhouse.__table__])
+    run("До (запрос на каждый датчик)", legacy)
+    cache = AlertStateCache()
+    run("После (кэш состояний)", lambda db, id_greenhouse, data: cached(cache, db, id_greenhouse, data))
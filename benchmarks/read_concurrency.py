@@ -0,0 +1,71 @@
+# Сравнение пропускной способности чтения последних показаний при росте числа
+# одновременных запросов: синхронный обработчик (пул потоков Starlette, 40 потоков)
+# и асинхронный обработчик на asyncpg. Задержка сети до базы имитируется pg_sleep.
+#
+# Запуск (нужен PostgreSQL): DATABASE_URL=postgresql://... python -m benchmarks.read_concurrency
+import asyncio
+import statistics
+import time
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.dependencies import DATABASE_URL, ASYNC_DATABASE_URL
+
+CONCURRENCY = (10, 50, 100, 200)
+REQUESTS = 1000
+DB_DELAY = 0.1
+# Пулы соединений больше пула потоков, чтобы сравнивался способ обработки, а не размер пула;
+# значение не должно превышать max_connections сервера
+POOL_SIZE = 80
+
+sync_engine = create_engine(DATABASE_URL, pool_size=POOL_SIZE)
+SyncSession = sessionmaker(bind=sync_engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=POOL_SIZE)
+AsyncSession = async_sessionmaker(async_engine)
+
+app = FastAPI()
+
+@app.get("/sync")
+def read_sync():
+    with SyncSession() as db:
+        return {"value": db.execute(select(text("1")).where(text(f"pg_sleep({DB_DELAY}) IS NOT NULL"))).scalar()}
+
+@app.get("/async")
+async def read_async():
+    async with AsyncSession() as db:
+        return {"value": (await db.execute(select(text("1")).where(text(f"pg_sleep({DB_DELAY}) IS NOT NULL")))).scalar()}
+
+async def run(path: str, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(client):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        # Прогрев: соединения пула открываются до начала замера
+        await asyncio.gather(*(client.get(path) for _ in range(concurrency)))
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(request(client) for _ in range(REQUESTS)))
+        elapsed = time.perf_counter() - started
+
+    p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+    print(f"{path:6} параллельно {concurrency:3}: {REQUESTS / elapsed:7.1f} запросов/с, p95 {p95:7.1f} мс")
+
+async def main():
+    for concurrency in CONCURRENCY:
+        await run("/sync", concurrency)
+        sync_engine.dispose()
+        await run("/async", concurrency)
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())